@@ -0,0 +1,306 @@
+"""A native engine for Allan-like deviations.
+
+The functions in here can be used as drop-in replacements for their
+counterparts in `allantools`, e.g. as `method` for `statistics.deviation()`.
+They convert the frequency data to phase only once and evaluate all requested
+τ's on that array in cache-friendly blocks, avoiding the large temporary
+arrays allantools allocates for every single τ.
+
+`adev`, `oadev` and `mdev` also accept 2D data of shape (samples, channels),
+evaluating all channels at once. Their deviations and errors are then of
+shape (τ's, channels).
+"""
+from typing import List, Tuple, Union
+import numpy as np
+
+_BLOCK_SIZE = 2**16
+"""Number of samples to process at once when summing up differences."""
+
+Result = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+"""(τ's, deviations, deviation errors, number of terms), like `allantools`."""
+
+
+def adev(data: np.ndarray, rate: float = 1., data_type: str = 'freq',
+         taus: Union[np.ndarray, str] = None) -> Result:
+    """Allan deviation, see `allantools.adev`."""
+    phase = _to_phase(data, rate, data_type)
+    ms = _ms_from_taus(taus, rate, len(phase))
+    sums = np.empty((len(ms),) + phase.shape[1:])
+    counts = np.empty(len(ms), dtype=np.int64)
+    for idx, m in enumerate(ms):
+        decimated = phase[::m]
+        diffs = decimated[2:] - 2 * decimated[1:-1] + decimated[:-2]
+        sums[idx] = _sum_squares(diffs)
+        counts[idx] = len(diffs)
+    return _result(ms, rate, sums / (2 * _per_m(ms, sums)**2), counts)
+
+
+def oadev(data: np.ndarray, rate: float = 1., data_type: str = 'freq',
+          taus: Union[np.ndarray, str] = None) -> Result:
+    """Overlapping Allan deviation, see `allantools.oadev`."""
+    phase = _to_phase(data, rate, data_type)
+    ms = _ms_from_taus(taus, rate, len(phase))
+    sums, counts = overlapping_sums(phase, ms)
+    return _result(ms, rate, sums / (2 * _per_m(ms, sums)**2), counts)
+
+
+def mdev(data: np.ndarray, rate: float = 1., data_type: str = 'freq',
+         taus: Union[np.ndarray, str] = None) -> Result:
+    """Modified Allan deviation, see `allantools.mdev`."""
+    phase = _to_phase(data, rate, data_type)
+    ms = _ms_from_taus(taus, rate, len(phase))
+
+    # Every term of the modified Allan variance is a sum of m second
+    # differences, which is a third difference of the phase's cumulative sum.
+    cumulative = np.empty((len(phase) + 1,) + phase.shape[1:])
+    cumulative[0] = 0
+    np.cumsum(phase, axis=0, out=cumulative[1:])
+
+    sums = np.zeros((len(ms),) + phase.shape[1:])
+    counts = np.maximum(len(phase) - 3 * ms + 1, 0)
+    buffer = np.empty((min(_BLOCK_SIZE, len(cumulative)),) + phase.shape[1:])
+    for idx, m in enumerate(ms):
+        for start in range(0, counts[idx], _BLOCK_SIZE):
+            stop = min(start + _BLOCK_SIZE, counts[idx])
+            diffs = buffer[:stop - start]
+            np.subtract(cumulative[start + 3*m:stop + 3*m],
+                        cumulative[start:stop], out=diffs)
+            diffs += 3 * (cumulative[start + m:stop + m]
+                          - cumulative[start + 2*m:stop + 2*m])
+            sums[idx] += _sum_squares(diffs)
+    return _result(ms, rate, sums / (2 * _per_m(ms, sums)**4), counts)
+
+
+def overlapping_sums(phase: np.ndarray, ms: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Sum up the squared overlapping second differences of `phase`.
+
+    The whole array is walked through block by block, evaluating all `ms` on
+    each block before moving on. This keeps the active part of `phase` in the
+    CPU cache and needs no temporary arrays larger than one block.
+
+    :param phase: Phase values, or 2D array of (values, channels).
+    :param ms: Sorted averaging factors to evaluate.
+    :returns: (sums of squared second differences, number of terms), one each
+                per averaging factor. The sums have an extra dimension for
+                channels, if `phase` does.
+    """
+    counts = np.maximum(len(phase) - 2 * ms, 0)
+    sums = np.zeros((len(ms),) + phase.shape[1:])
+    if not len(ms):
+        return sums, counts
+    buffer = np.empty((min(_BLOCK_SIZE, len(phase)),) + phase.shape[1:])
+    for start in range(0, counts[0], _BLOCK_SIZE):
+        for idx, m in enumerate(ms):
+            stop = min(start + _BLOCK_SIZE, counts[idx])
+            if stop <= start:  # This and all larger m's are done.
+                break
+            diffs = buffer[:stop - start]
+            np.subtract(phase[start + 2*m:stop + 2*m], phase[start + m:stop + m],
+                        out=diffs)
+            diffs -= phase[start + m:stop + m]
+            diffs += phase[start:stop]
+            sums[idx] += _sum_squares(diffs)
+    return sums, counts
+
+
+def sliding_oadev(data: np.ndarray, rate: float, window: int, step: int,
+                  taus: Union[np.ndarray, str] = None) -> Tuple[np.ndarray, np.ndarray,
+                                                                np.ndarray]:
+    """Overlapping Allan deviation of a sliding window ("dynamic" ADEV).
+
+    Equals `oadev()` of every window, but all windows are evaluated in a single
+    pass over the data, see `sliding_sums()`.
+
+    :param data: Frequency values.
+    :param window: Length of each window in samples.
+    :param step: Number of samples to advance the window by.
+    :param taus: Like for `oadev()`. τ's too long for a window are dropped.
+    :returns: (first sample of each window, τ's, deviations). The latter are
+                of shape (number of windows, number of τ's).
+    """
+    phase = _to_phase(data, rate, 'freq')
+    ms = _ms_from_taus(taus, rate, window + 1)
+    ms = ms[window + 1 - 2 * ms > 1]
+    starts, sums, counts = sliding_sums(phase, ms, window, step)
+    devs = np.sqrt(sums / (2 * ms.astype(float)**2 * counts)) * rate
+    return starts, ms / rate, devs
+
+
+def sliding_sums(phase: np.ndarray, ms: np.ndarray, window: int,
+                 step: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Like `overlapping_sums()`, but for every position of a sliding window.
+
+    Each window of `window` frequency samples spans `window + 1` phase values.
+    Rather than summing up every window on its own, the squared differences
+    are summed up once, piece by piece between the points where terms enter or
+    leave a window. A window's sum is then the difference of two prefix sums
+    of those pieces. As with `overlapping_sums()`, the data is processed in
+    blocks, evaluating all `ms` on each block.
+
+    :param ms: Averaging factors, each less than `window / 2`.
+    :returns: (first sample of each window, sums of shape (number of windows,
+                number of ms), number of terms per window for each m)
+    """
+    n_windows = max((len(phase) - 1 - window) // step + 1, 0)
+    starts = np.arange(n_windows) * step
+    counts = window + 1 - 2 * ms
+    if not n_windows or not len(ms):
+        return starts, np.empty((n_windows, len(ms))), counts
+    # For every m, the prefix sums are needed at the window starts and ends.
+    # Pieces must not cross blocks, so the block starts are added as well.
+    n_terms = starts[-1] + counts
+    edges = [np.union1d(np.union1d(starts, starts + count),
+                        np.arange(0, n_terms[idx], _BLOCK_SIZE))
+             for idx, count in enumerate(counts)]
+    pieces: List[List[np.ndarray]] = [[] for _ in ms]
+    buffer = np.empty(min(_BLOCK_SIZE, n_terms[0]))
+    for start in range(0, n_terms[0], _BLOCK_SIZE):
+        for idx, m in enumerate(ms):
+            stop = min(start + _BLOCK_SIZE, n_terms[idx])
+            if stop <= start:  # This and all larger m's are done.
+                break
+            diffs = buffer[:stop - start]
+            np.subtract(phase[start + 2*m:stop + 2*m], phase[start + m:stop + m],
+                        out=diffs)
+            diffs -= phase[start + m:stop + m]
+            diffs += phase[start:stop]
+            diffs *= diffs
+            local = edges[idx][(edges[idx] >= start) & (edges[idx] < stop)] - start
+            pieces[idx].append(np.add.reduceat(diffs, local))
+
+    sums = np.empty((n_windows, len(ms)))
+    for idx, count in enumerate(counts):
+        prefix = np.zeros(len(edges[idx]))
+        np.cumsum(np.concatenate(pieces[idx]), out=prefix[1:])
+        sums[:, idx] = (prefix[np.searchsorted(edges[idx], starts + count)]
+                        - prefix[np.searchsorted(edges[idx], starts)])
+    return starts, sums, counts
+
+
+class OadevAccumulator:
+    """Running sums for the overlapping Allan deviation of a data stream.
+
+    Only the last `2 * max(ms)` phase values are kept in memory, no matter how
+    much data is fed in. They are held in a buffer of about twice that size
+    (plus the largest batch fed in), see `_reserve()`.
+    """
+
+    def __init__(self, rate: float, ms: np.ndarray) -> None:
+        """
+        :param rate: Sample rate of the frequency data in Hz.
+        :param ms: Averaging factors to evaluate.
+        """
+        self.rate = rate
+        self.ms: np.ndarray = np.unique(np.asarray(ms, dtype=np.int64))
+        self.sums = np.zeros(len(self.ms))
+        self.counts = np.zeros(len(self.ms), dtype=np.int64)
+        self._history = np.zeros(1)
+        """Buffer holding the latest phase values, starting with the initial
+        zero phase."""
+        self._length = 1
+        """Number of phase values held in `_history`."""
+        self._offset: float = None
+        """Frequency offset removed before integrating, see `_to_phase()`."""
+
+    def add(self, freqs: np.ndarray) -> None:
+        """Feed the next frequency values of the stream.
+
+        The cost only depends on the number of values fed in and on the number
+        of averaging factors, not on their size.
+        """
+        if not len(freqs):
+            return
+        if self._offset is None:
+            self._offset = np.mean(freqs)
+        self._reserve(len(freqs))
+        start, end = self._length, self._length + len(freqs)
+        phase = self._history[:end]
+        new_phase = phase[start:]
+        np.subtract(freqs, self._offset, out=new_phase)
+        np.cumsum(new_phase, out=new_phase)
+        new_phase /= self.rate
+        new_phase += phase[start - 1]
+        self._length = end
+
+        for idx, m in enumerate(self.ms):
+            # Only evaluate terms ending in the new data.
+            first = max(start, 2 * m) - 2 * m
+            sums, counts = overlapping_sums(phase[first:], self.ms[idx:idx + 1])
+            self.sums[idx] += sums[0]
+            self.counts[idx] += counts[0]
+
+    def result(self) -> Result:
+        """The deviation of all the data fed in so far."""
+        return _result(self.ms, self.rate,
+                       self.sums / (2 * self.ms.astype(float)**2), self.counts)
+
+    def _reserve(self, n_new: int) -> None:
+        """Make room for `n_new` phase values after the ones held.
+
+        Only the last `2 * max(ms)` values are needed later on. They are moved
+        to the front of the buffer when it is full, which is rare enough to
+        keep the amortized cost per value constant. The buffer grows as needed.
+        """
+        if self._length + n_new <= len(self._history):
+            return
+        n_keep = min(self._length, 2 * self.ms[-1]) if len(self.ms) else 1
+        kept = self._history[self._length - n_keep:self._length]
+        if 2 * (n_keep + n_new) > len(self._history):
+            self._history = np.empty(2 * (n_keep + n_new))
+        self._history[:n_keep] = kept  # NumPy handles the overlap.
+        self._length = n_keep
+
+
+def _ms_from_taus(taus: Union[np.ndarray, str], rate: float, n_phase: int) -> np.ndarray:
+    """Convert τ's to distinct averaging factors like `allantools` does.
+
+    :param taus: τ values in seconds. `None` or "octave" for 1, 2, 4, ...
+                samples.
+    :param n_phase: Length of the phase data.
+    """
+    if taus is None or isinstance(taus, str):
+        if taus not in (None, 'octave'):
+            raise ValueError("Unsupported taus {}.".format(taus))
+        taus = 2.**np.arange(int(np.log2(max(n_phase, 1))) + 1) / rate
+
+    ms = np.round(np.asarray(taus, dtype=float) * rate)
+    return np.unique(ms[(ms > 0) & (ms < n_phase)]).astype(np.int64)
+
+
+def _per_m(values: np.ndarray, like: np.ndarray) -> np.ndarray:
+    """Float values per averaging factor, broadcastable against `like`."""
+    return values.astype(float).reshape((-1,) + (1,) * (like.ndim - 1))
+
+
+def _result(ms: np.ndarray, rate: float, variances: np.ndarray,
+            counts: np.ndarray) -> Result:
+    """Assemble the result, dropping τ's evaluated with too few terms."""
+    valid = counts > 1
+    n_terms = _per_m(counts[valid], variances)
+    devs = np.sqrt(variances[valid] / n_terms) * rate
+    return (ms[valid] / rate, devs, devs / np.sqrt(n_terms), counts[valid])
+
+
+def _sum_squares(diffs: np.ndarray) -> np.ndarray:
+    """Sum of squares along the first axis, per channel for 2D data."""
+    return np.einsum('i...,i...->...', diffs, diffs)
+
+
+def _to_phase(data: np.ndarray, rate: float, data_type: str) -> np.ndarray:
+    """Convert input data to phase, like `allantools` does.
+
+    As all deviations computed here are insensitive to a linear phase drift,
+    the mean frequency is removed beforehand. This keeps the phase values (and
+    their cumulative sums) small, greatly reducing rounding errors.
+    """
+    data = np.asarray(data, dtype=float)
+    if data_type == 'phase':
+        return data
+    if data_type != 'freq':
+        raise ValueError("Unknown data type {}.".format(data_type))
+    phase = np.empty((len(data) + 1,) + data.shape[1:])
+    phase[0] = 0
+    np.subtract(data, np.mean(data, axis=0), out=phase[1:])
+    np.cumsum(phase[1:], axis=0, out=phase[1:])
+    phase /= rate
+    return phase
@@ -0,0 +1,298 @@
+"""Measure the performance of freqle's hot paths.
+
+Run as `python -m freqle.benchmarks` to run the whole suite on synthetic data,
+or as `python -m freqle.benchmarks <format>:<counter file> ...` to get the
+parser throughput on real data. Results are printed (or, given `--output`,
+written) as JSON, such that runs can be compared over time.
+
+The suite first checks the time it takes to import each of freqle's modules
+in a fresh interpreter against `IMPORT_BUDGET`. Slow dependencies like
+matplotlib must only be imported when used, see `LAZY_DEPENDENCIES`. If the
+budget is exceeded, the results are reported nonetheless, but the run fails.
+
+Then, the suite writes synthetic counter files of every supported format and times
+parsing them, setting up a `FreqSeries`, calculating deviations and ASDs as
+well as plotting and saving. Every benchmark is run with caching disabled, see
+`cache.disabled()`. Peak memory is measured in a separate run using
+`tracemalloc`, which slows down execution and thus would distort the timings.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Sequence
+import numpy as np
+import pandas as pd
+
+from . import cache, parsers, statistics
+from .freq_series import FreqSeries
+
+PARSERS: Dict[str, Callable] = {
+    'fokus2': parsers.fokus2_txt,
+    'cnt91': parsers.pendulum_cnt91_txt,
+    'generic': parsers.generic_freq_counter,
+    'menlo': lambda file_name, **kwargs: parsers.menlo_lambda_freq_counter(
+        file_name, None, None, **kwargs)}
+"""Parsers to benchmark, by name of the file format."""
+
+IMPORT_BUDGET = .2
+"""Seconds importing any of freqle's modules may take. Numpy and pandas are
+imported beforehand, as freqle can't do without them."""
+MODULES = ('allan', 'cache', 'freq_series', 'instrumentation', 'live',
+           'parallel', 'parsers', 'plotter', 'spectrum', 'statistics')
+"""Modules to check the import time of."""
+LAZY_DEPENDENCIES = ('allantools', 'ballpark', 'matplotlib', 'scipy')
+"""Packages no freqle module may import before they are actually needed."""
+
+SIZES = (10**4, 10**5, 10**6)
+"""Default numbers of samples to run the suite with. Use `--sizes` to go up to
+10**8 samples, which takes a while and several GB of disk space."""
+
+_RATE = 1e3
+"""Sample rate of the synthetic data in Hz."""
+_NOMINAL_FREQ = 1e6
+"""Mean frequency of the synthetic data in Hz."""
+_START = pd.Timestamp('2020-01-01 00:00:00')
+_BLOCK_SIZE = 2**20
+"""Number of lines to write to a synthetic file at once."""
+_IMPORT_SCRIPT = """
+import json, sys, time
+import numpy, pandas
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds,
+                  'lazy_loaded': [name for name in {lazy!r} if name in sys.modules]}}))
+"""
+
+
+def measure(func: Callable, *args, repeat: int = 1, **kwargs) -> Dict[str, float]:
+    """Time `func(*args, **kwargs)` and determine its peak memory usage.
+
+    An untimed warm-up call precedes the measurements, such that one-time
+    costs like lazy imports or hashing the data for memoization don't count.
+
+    :param repeat: Report the fastest of that many runs.
+    :returns: The duration in seconds and the peak of memory allocated (by
+                Python and NumPy) in bytes.
+    """
+    func(*args, **kwargs)
+    seconds = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        seconds = min(seconds, time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': seconds, 'peak_bytes': peak}
+
+
+def import_time(module: str, repeat: int = 1) -> Dict[str, Any]:
+    """Time importing `module` in a fresh interpreter.
+
+    :param module: Name of a freqle module, like "plotter".
+    :param repeat: Report the fastest of that many imports.
+    :returns: The duration in seconds, the `LAZY_DEPENDENCIES` loaded by the
+                import and whether the import is within `IMPORT_BUDGET`.
+    """
+    script = _IMPORT_SCRIPT.format(module='{}.{}'.format(__package__, module),
+                                   lazy=LAZY_DEPENDENCIES)
+    # Make sure the interpreter finds freqle the same way this one does.
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    runs = [json.loads(subprocess.run([sys.executable, '-c', script], env=env,
+                                      check=True, stdout=subprocess.PIPE).stdout)
+            for _ in range(repeat)]
+    result = min(runs, key=lambda run: run['seconds'])
+    result['within_budget'] = (result['seconds'] <= IMPORT_BUDGET
+                               and not result['lazy_loaded'])
+    return result
+
+
+def parser_throughput(parser: Callable, file_name: str, **kwargs) -> float:
+    """Parse `file_name` and return the throughput in MB/s.
+
+    :param kwargs: Passed to `parser`. If `chunksize` is given, all chunks are
+                consumed.
+    """
+    start = time.perf_counter()
+    _consume(parser(file_name, **kwargs))
+    duration = time.perf_counter() - start
+    return os.path.getsize(file_name) / 1e6 / duration
+
+
+def run_suite(sizes: Sequence[int] = SIZES, directory: str = None,
+              repeat: int = 1) -> List[Dict[str, Any]]:
+    """Run all benchmarks on synthetic data of the given sizes.
+
+    :param directory: Where to put the synthetic files. Defaults to a temporary
+                directory that is removed afterwards.
+    :param repeat: See `measure()`.
+    :returns: One record per benchmark and size.
+    """
+    if directory is None:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            return run_suite(sizes, temp_dir, repeat)
+
+    records = [_record('import_' + module, None, import_time(module, repeat))
+               for module in MODULES]
+    with cache.disabled():
+        for n_samples in sizes:
+            for name, parser in PARSERS.items():
+                file_name = os.path.join(directory, '{}_{}.txt'.format(name, n_samples))
+                write_counter_file(name, file_name, n_samples)
+                result = measure(lambda: _consume(parser(file_name)), repeat=repeat)  # pylint: disable=cell-var-from-loop
+                result['mb_per_s'] = os.path.getsize(file_name) / 1e6 / result['seconds']
+                records.append(_record('parse_' + name, n_samples, result))
+                os.remove(file_name)
+
+            data = _synthetic_series(n_samples)
+            # Include the sample rate analysis, which is done lazily.
+            records.append(_record('freq_series', n_samples, measure(
+                lambda: FreqSeries(data).sample_rate, repeat=repeat)))  # pylint: disable=cell-var-from-loop
+            mmt = FreqSeries(data)
+            for estimate_error in (False, True):
+                records.append(_record(
+                    'deviation' + ('_with_error' if estimate_error else ''),
+                    n_samples, measure(statistics.deviation, mmt,
+                                       estimate_error=estimate_error, repeat=repeat)))
+            records.append(_record('asd', n_samples, measure(
+                statistics.asd, mmt, repeat=repeat)))
+            records.append(_record('cache_save', n_samples, measure(
+                cache.save, mmt, os.path.join(directory, 'series.fqs'), repeat=repeat)))
+            records.extend(_plotting_records(mmt, directory, repeat))
+    return records
+
+
+def write_counter_file(file_format: str, file_name: str, n_samples: int,
+                       seed: int = 0) -> None:
+    """Write a synthetic counter file, sampled at `_RATE` with white noise.
+
+    :param file_format: One of the keys of `PARSERS`.
+    """
+    header = {'fokus2': "FOKUS2 benchmark\tfreq\n",
+              'cnt91': "CNT-91 benchmark".ljust(20) + "\t{}\tsynthetic\n".format(_START),
+              'generic': "time\tfreq\n",
+              'menlo': ""}[file_format]
+    rng = np.random.default_rng(seed)
+    with open(file_name, 'w') as file:
+        file.write(header)
+        for start in range(0, n_samples, _BLOCK_SIZE):
+            samples = np.arange(start, min(start + _BLOCK_SIZE, n_samples))
+            freqs = _NOMINAL_FREQ + rng.standard_normal(len(samples))
+            if file_format == 'fokus2':  # Microseconds since epoch.
+                columns = {'time': _START.value // 1000 + samples * int(1e6 / _RATE)}
+            elif file_format == 'menlo':
+                times = _START + pd.to_timedelta(samples / _RATE, unit='s')
+                columns = {'date': times.strftime('%y%m%d'),
+                           'time': times.strftime('%H%M%S.%f'),
+                           'channel': np.ones(len(samples), dtype=int)}
+            else:  # Seconds since the start of the measurement.
+                columns = {'time': samples / _RATE}
+            columns['freq'] = freqs
+            if file_format == 'menlo':
+                columns['reference'] = np.full(len(samples), 2 * _NOMINAL_FREQ)
+            pd.DataFrame(columns).to_csv(
+                file, sep=' ' if file_format == 'menlo' else '\t', header=False,
+                index=False, float_format='%.6f')
+
+
+def _consume(parsed: parsers.Parsed) -> None:
+    """Make sure a parser did all of its work, even if chunked."""
+    if not isinstance(parsed, FreqSeries):
+        for _ in parsed:
+            pass
+
+
+def _plotting_records(mmt: FreqSeries, directory: str,
+                      repeat: int) -> List[Dict[str, Any]]:
+    # Plotting is imported lazily, as it drags in a lot of dependencies.
+    import matplotlib.pyplot as plt  # pylint: disable=import-outside-toplevel
+    from . import plotter  # pylint: disable=import-outside-toplevel
+
+    def plot() -> None:
+        plotter.plot_freq(mmt)
+        plt.close('all')
+
+    def plot_and_save() -> None:
+        figure, _ = plotter.plot_freq(mmt)
+        plotter.save(figure, os.path.join(directory, 'plot.png'))
+        plt.close('all')
+
+    return [_record('plot_freq', len(mmt), measure(plot, repeat=repeat)),
+            _record('plot_freq_save', len(mmt), measure(plot_and_save, repeat=repeat))]
+
+
+def _record(benchmark: str, n_samples: Optional[int], result: Dict[str, float]) -> Dict[str, Any]:
+    return dict(benchmark=benchmark, n_samples=n_samples, **result)
+
+
+def _synthetic_series(n_samples: int, seed: int = 0) -> pd.Series:
+    index = pd.date_range(_START, periods=n_samples, freq=pd.Timedelta(seconds=1 / _RATE))
+    rng = np.random.default_rng(seed)
+    return pd.Series(_NOMINAL_FREQ + rng.standard_normal(n_samples), index=index,
+                     name='synthetic')
+
+
+def _environment() -> Dict[str, str]:
+    """Describe the machine and software versions, for comparing runs."""
+    return {'date': datetime.datetime.now().isoformat(),
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__}
+
+
+def main() -> None:
+    """Run the suite or, if files are given, report their parser throughput.
+
+    File arguments are like `<format>:<file name>`, with `format` being one of
+    the keys of `PARSERS`.
+    """
+    arg_parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    arg_parser.add_argument('files', nargs='*', help="<format>:<file name>")
+    arg_parser.add_argument('--sizes', nargs='+', type=float, default=SIZES,
+                            help="Numbers of samples to run the suite with.")
+    arg_parser.add_argument('--repeat', type=int, default=1,
+                            help="Report the fastest of that many runs.")
+    arg_parser.add_argument('--directory', help="Where to write synthetic files.")
+    arg_parser.add_argument('--output', help="JSON file to write the results to.")
+    args = arg_parser.parse_args()
+
+    if args.files:
+        with cache.disabled():
+            records = [
+                {'benchmark': 'parse_' + name, 'file': file_name,
+                 'mb_per_s': parser_throughput(PARSERS[name], file_name)}
+                for name, file_name in (arg.split(':', 1) for arg in args.files)]
+    else:
+        records = run_suite([int(size) for size in args.sizes], args.directory,
+                            args.repeat)
+
+    report = json.dumps({'environment': _environment(), 'results': records}, indent=2)
+    if args.output is None:
+        print(report)
+    else:
+        with open(args.output, 'w') as file:
+            file.write(report + '\n')
+
+    over_budget = [record['benchmark'] for record in records
+                   if not record.get('within_budget', True)]
+    if over_budget:
+        sys.exit("Import budget exceeded: {}".format(', '.join(over_budget)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,430 @@
+"""Caches for parsed `FreqSeries` and for analysis results.
+
+Parsed series
+-------------
+
+A cache file consists of
+  - the magic bytes `_MAGIC`,
+  - the length of the header as little endian uint64,
+  - a JSON header holding the series' metadata and the array layout,
+  - the (int64 nanosecond or float64 second) timestamps, unless the series is
+    sampled equidistantly, in which case start and period are in the header,
+  - the float64 values.
+Arrays are aligned to `_ALIGNMENT` bytes and loaded via `np.memmap`, making
+opening a cached series almost instant and free of copies. Equidistant
+timestamps are recreated on loading, unless the series used an implicit
+`EquidistantIndex`, such that loaded series equal the saved ones.
+
+Parsers decorated with `@cached` transparently store their results in the
+cache directory, keyed on the file's path, modification time and size as well
+as the parser arguments. The directory defaults to `~/.cache/freqle` and can be
+changed by setting the `FREQLE_CACHE_DIR` environment variable or by calling
+`set_directory()`. Cached series are mapped copy-on-write, so they can be
+modified like freshly parsed ones. The least recently used series are deleted
+once the cache exceeds its size limit, see `configure_series()`.
+
+Analysis results
+----------------
+Functions decorated with `@memoized` (like `statistics.deviation()`) remember
+their results, keyed on the fingerprint of the analyzed series and all other
+arguments. Results are kept in an in-memory LRU cache. Optionally, they are
+also kept on disk in the cache directory, see `configure_results()`.
+
+Calls passing callables that can't be imported by name (like lambdas, local
+functions or `functools.partial` objects) aren't memoized, as there is no
+telling them apart. Series modified in place (e.g. through `data.iloc`) must
+be `FreqSeries.invalidate()`d, as their fingerprint would be stale otherwise.
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+import functools
+import hashlib
+import importlib
+import inspect
+import json
+import os
+import pickle
+import tempfile
+from typing import Any, Callable, Iterator, Optional
+from weakref import WeakKeyDictionary
+import numpy as np
+import pandas as pd
+
+from . import instrumentation
+from .freq_series import EquidistantIndex, FreqSeries
+
+_MAGIC = b'FREQLE\x00\x03'
+_ALIGNMENT = 64
+_SUFFIX = '.fqs'
+_RESULTS_SUBDIR = 'results'
+_RESULT_SUFFIX = '.pickle'
+_IGNORED_ARGS = ('executor', 'n_jobs')
+"""Arguments not affecting the result of memoized functions."""
+
+_directory: Optional[str] = os.environ.get(
+    'FREQLE_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'freqle'))
+_files: 'WeakKeyDictionary[FreqSeries, str]' = WeakKeyDictionary()
+"""Cache files of the series returned by `@cached` parsers, see `file_of()`."""
+_results: 'OrderedDict[str, bytes]' = OrderedDict()
+"""The in-memory result cache, holding pickled results by key."""
+_max_results = 256
+_max_disk_bytes = 0
+"""Size limit of the on-disk result cache. It is disabled by default."""
+_max_series_bytes = 2**34
+"""Size limit of the cached series."""
+
+
+def configure_results(max_results: int = None, max_disk_bytes: int = None) -> None:
+    """Set the size limits of the result cache.
+
+    :param max_results: Number of results to keep in memory. 0 disables
+                in-memory caching.
+    :param max_disk_bytes: Size the on-disk results may take up, before the
+                least recently used are deleted. 0 (the default) disables
+                on-disk caching.
+    """
+    global _max_results, _max_disk_bytes  # pylint: disable=global-statement
+    if max_results is not None:
+        _max_results = max_results
+        _trim_memory()
+    if max_disk_bytes is not None:
+        _max_disk_bytes = max_disk_bytes
+
+
+def configure_series(max_disk_bytes: int) -> None:
+    """Set the size the cached series may take up, before the least recently
+    used are deleted."""
+    global _max_series_bytes  # pylint: disable=global-statement
+    _max_series_bytes = max_disk_bytes
+
+
+def clear_results() -> None:
+    """Empty the in-memory result cache."""
+    _results.clear()
+
+
+@contextmanager
+def disabled() -> Iterator[None]:
+    """Bypass both caches for the duration of the context, e.g. for benchmarks."""
+    global _directory, _max_results  # pylint: disable=global-statement
+    directory, max_results = _directory, _max_results
+    _directory, _max_results = None, 0
+    try:
+        yield
+    finally:
+        _directory, _max_results = directory, max_results
+
+
+def file_of(mmt: FreqSeries) -> Optional[str]:
+    """The cache file a series returned by a `@cached` parser was loaded from
+    or saved to. Note that it may have been deleted since, see
+    `configure_series()`.
+
+    :returns: `None` if the series didn't go through the cache.
+    """
+    return _files.get(mmt)
+
+
+def is_enabled() -> bool:
+    """Are parsed series cached on disk?"""
+    return _directory is not None
+
+
+def set_directory(directory: Optional[str]) -> None:
+    """Store cached series in `directory`. `None` disables the cache."""
+    global _directory  # pylint: disable=global-statement
+    _directory = directory
+
+
+def cached(parser: Callable) -> Callable:
+    """Cache the `FreqSeries` returned by `parser`.
+
+    The parser's first argument must be the file name. Open files and other
+    buffers, chunked parsing (a `chunksize` argument that is not `None`) and
+    multi-channel results bypass the cache.
+    """
+    signature = inspect.signature(parser)
+
+    @functools.wraps(parser)
+    def wrapper(*args, **kwargs):
+        arguments = signature.bind(*args, **kwargs)
+        arguments.apply_defaults()
+        params = dict(arguments.arguments)
+        file_name = params.pop(next(iter(signature.parameters)))
+        params.pop('engine', None)  # Doesn't change the result.
+        if (_directory is None or params.get('chunksize') is not None
+                or not isinstance(file_name, (str, bytes, os.PathLike))):
+            return parser(*args, **kwargs)
+
+        stat = os.stat(file_name)
+        key = repr((parser.__module__, parser.__qualname__,
+                    os.path.abspath(file_name), stat.st_mtime_ns, stat.st_size,
+                    sorted(params.items())))
+        cache_file = os.path.join(
+            _directory, hashlib.sha256(key.encode()).hexdigest() + _SUFFIX)
+        try:
+            mmt = load(cache_file)
+        except (OSError, ValueError):  # Not cached yet or unreadable.
+            pass
+        else:
+            instrumentation.count('series_cache_hits')
+            _touch(cache_file)
+            _files[mmt] = cache_file
+            return mmt
+        instrumentation.count('series_cache_misses')
+        mmt = parser(*args, **kwargs)
+        if not isinstance(mmt, FreqSeries):  # Only single series are cached.
+            return mmt
+        try:
+            save(mmt, cache_file)
+            _files[mmt] = cache_file
+            _trim_disk(_directory, _SUFFIX, _max_series_bytes)
+        except OSError:  # Caching is an optimization only.
+            pass
+        return mmt
+    return wrapper
+
+
+def memoized(func: Callable) -> Callable:
+    """Cache the results of an analysis function like `statistics.deviation`.
+
+    The function's first argument must be a `FreqSeries`. It is identified by
+    its fingerprint, original frequency and sample rate analysis, such that
+    equal data produces cache hits. The result must be a `NamedTuple` with a `measurement` field,
+    which is set to the actual argument on every cache hit. Calls that can't
+    be keyed reliably (see module docstring) aren't memoized.
+    """
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # Spare hashing the data if there is nowhere to look for results.
+        if not _max_results and (_directory is None or not _max_disk_bytes):
+            return func(*args, **kwargs)
+        arguments = signature.bind(*args, **kwargs)
+        arguments.apply_defaults()
+        key = _result_key(func, arguments.arguments)
+        if key is None:
+            return func(*args, **kwargs)
+        mmt = next(iter(arguments.arguments.values()))
+        pickled = _lookup(key)
+        if pickled is not None:
+            instrumentation.count('result_cache_hits')
+            return pickle.loads(pickled)._replace(measurement=mmt)
+        instrumentation.count('result_cache_misses')
+        result = func(*args, **kwargs)
+        _store(key, pickle.dumps(result._replace(measurement=None)))
+        return result
+    return wrapper
+
+
+def save(mmt: FreqSeries, file_name: str) -> None:
+    """Write a series to `file_name` in the cache format.
+
+    The file is replaced atomically, such that concurrent readers never see a
+    partially written file.
+    """
+    header = {'session': mmt.session, 'org_freq': mmt.org_freq,
+              'name': mmt.name, 'rate': mmt.sample_rate,
+              'regularity': mmt.sampling_regularity, 'length': len(mmt),
+              'fingerprint': mmt.fingerprint}
+    times = None
+    if mmt.equidistant_index is not None:
+        header.update(index='equidistant', start=mmt.equidistant_index.start,
+                      period=mmt.equidistant_index.period, implicit=True)
+    elif isinstance(mmt.data.index, pd.DatetimeIndex):
+        stamps = mmt.data.index.values.astype('datetime64[ns]', copy=False).view(np.int64)
+        if mmt.sampling_regularity == 1 and len(stamps) > 1:
+            # Only store the timestamps' layout, but recreate them on loading.
+            header.update(index='equidistant', start=int(stamps[0]),
+                          period=float(stamps[1] - stamps[0]), implicit=False)
+        else:
+            header['index'] = 'datetime'
+            times = stamps
+    else:
+        header['index'] = 'float'
+        times = mmt.data.index.values.astype(np.float64, copy=False)
+
+    # Lay out the arrays after the header, determining its length first.
+    header.update(times_offset=0, values_offset=0)
+    prefix_length = _aligned(len(_MAGIC) + 8 + len(_encode(header)) + 64)
+    header['times_offset'] = prefix_length
+    header['values_offset'] = prefix_length + _aligned(
+        0 if times is None else times.nbytes)
+    encoded = _encode(header)
+
+    directory = os.path.dirname(os.path.abspath(file_name))
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=directory, delete=False) as file:
+        try:
+            file.write(_MAGIC)
+            file.write(np.uint64(len(encoded)).tobytes())
+            file.write(encoded)
+            if times is not None:
+                file.seek(header['times_offset'])
+                file.write(np.ascontiguousarray(times).tobytes())
+            file.seek(header['values_offset'])
+            file.write(np.ascontiguousarray(mmt.values, dtype=np.float64).tobytes())
+            file.close()
+            os.replace(file.name, file_name)
+        except BaseException:
+            os.unlink(file.name)
+            raise
+
+
+def load(file_name: str) -> FreqSeries:
+    """Open a series written by `save()`, memory-mapping its data.
+
+    The mapping is copy-on-write: The series can be modified, without the
+    changes reaching the file.
+
+    :raises ValueError: The file is not in the cache format.
+    """
+    with open(file_name, 'rb') as file:
+        if file.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError("{} is no freqle cache file.".format(file_name))
+        header_length = int(np.frombuffer(file.read(8), dtype=np.uint64)[0])
+        header = json.loads(file.read(header_length).decode())
+
+    length = header['length']
+    values = _map(file_name, np.float64, header['values_offset'], length)
+    if header['index'] == 'equidistant' and header['implicit']:
+        mmt = FreqSeries(pd.Series(values, name=header['name'], copy=False),
+                         original_freq=header['org_freq'],
+                         session=header['session'],
+                         index=EquidistantIndex(header['start'], header['period']))
+    else:
+        if header['index'] == 'equidistant':
+            index = pd.DatetimeIndex(
+                (header['start'] + int(header['period']) * np.arange(length, dtype=np.int64))
+                .view('datetime64[ns]'), copy=False)
+        elif header['index'] == 'datetime':
+            index = pd.DatetimeIndex(
+                _map(file_name, np.int64, header['times_offset'], length)
+                .view('datetime64[ns]'), copy=False)
+        else:
+            index = pd.Index(_map(file_name, np.float64, header['times_offset'], length),
+                             copy=False)
+        data = pd.Series(values, index=index, name=header['name'], copy=False)
+        mmt = FreqSeries(data, original_freq=header['org_freq'],
+                         session=header['session'],
+                         rate_analysis=(header['rate'], header['regularity']))
+    # Spare hashing the whole file when memoizing results.
+    mmt._fingerprint = header['fingerprint']  # pylint: disable=protected-access
+    return mmt
+
+
+def _aligned(n_bytes: int) -> int:
+    return -(-n_bytes // _ALIGNMENT) * _ALIGNMENT
+
+
+def _encode(header: dict) -> bytes:
+    # NumPy scalars (e.g. column names) are converted to Python types.
+    return json.dumps(header, default=lambda obj: obj.item()).encode()
+
+
+def _map(file_name: str, dtype: type, offset: int, length: int) -> np.ndarray:
+    if not length:  # np.memmap can't map empty arrays.
+        return np.empty(0, dtype=dtype)
+    return np.memmap(file_name, dtype=dtype, mode='c', offset=offset, shape=(length,))
+
+
+def _is_importable(func: Callable) -> bool:
+    """Does `func` resolve to itself by its module and qualified name?"""
+    try:
+        resolved: Any = importlib.import_module(func.__module__)
+        for name in func.__qualname__.split('.'):
+            resolved = getattr(resolved, name)
+    except (AttributeError, ImportError, TypeError):
+        return False
+    return resolved is func
+
+
+def _lookup(key: str) -> Optional[bytes]:
+    """Get a pickled result from memory or, failing that, from disk."""
+    if _max_results and key in _results:
+        _results.move_to_end(key)
+        return _results[key]
+    if _directory is None or not _max_disk_bytes:
+        return None
+    file_name = os.path.join(_directory, _RESULTS_SUBDIR, key + _RESULT_SUFFIX)
+    try:
+        with open(file_name, 'rb') as file:
+            pickled = file.read()
+    except OSError:
+        return None
+    _touch(file_name)
+    _remember(key, pickled)
+    return pickled
+
+
+def _remember(key: str, pickled: bytes) -> None:
+    if _max_results:
+        _results[key] = pickled
+        _trim_memory()
+
+
+def _result_key(func: Callable, arguments: 'OrderedDict[str, Any]') -> Optional[str]:
+    """Identify a call by the function, the data and all relevant arguments.
+
+    :returns: `None` if an argument is a callable not importable by name.
+    """
+    parts = [func.__module__, func.__qualname__]
+    for name, value in arguments.items():
+        if name in _IGNORED_ARGS:
+            continue
+        if isinstance(value, FreqSeries):
+            value = (value.fingerprint, value.org_freq, value.sample_rate,
+                     value.sampling_regularity)
+        elif isinstance(value, np.ndarray):
+            value = (value.dtype.str, value.shape,
+                     hashlib.blake2b(np.ascontiguousarray(value)).hexdigest())
+        elif callable(value):
+            if not _is_importable(value):
+                return None
+            value = (value.__module__, value.__qualname__)
+        parts.append((name, value))
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+
+def _store(key: str, pickled: bytes) -> None:
+    """Put a pickled result into memory and on disk, evicting old ones."""
+    _remember(key, pickled)
+    if _directory is None or not _max_disk_bytes:
+        return
+    directory = os.path.join(_directory, _RESULTS_SUBDIR)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=directory, delete=False) as file:
+            file.write(pickled)
+        os.replace(file.name, os.path.join(directory, key + _RESULT_SUFFIX))
+        _trim_disk(directory, _RESULT_SUFFIX, _max_disk_bytes)
+    except OSError:  # Caching is an optimization only.
+        pass
+
+
+def _touch(file_name: str) -> None:
+    """Mark a cache file as recently used."""
+    try:
+        os.utime(file_name)
+    except OSError:  # E.g. a read-only cache, which won't be trimmed anyway.
+        pass
+
+
+def _trim_disk(directory: str, suffix: str, max_bytes: int) -> None:
+    """Delete the least recently used `suffix` files exceeding `max_bytes`."""
+    entries = [entry for entry in os.scandir(directory) if entry.name.endswith(suffix)]
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    total = 0
+    for entry in entries:
+        total += entry.stat().st_size
+        if total > max_bytes:
+            try:
+                os.unlink(entry.path)
+            except OSError:  # E.g. still mapped on Windows, try again later.
+                pass
+
+
+def _trim_memory() -> None:
+    while len(_results) > _max_results:
+        _results.popitem(last=False)
@@ -1,9 +1,32 @@
-"""Provides the FreqSeries class, an object wrapping counter measurements."""
+"""Provides the FreqSeries class, an object wrapping counter measurements.
 
-from typing import Tuple
+`MultiChannelSeries` holds several series recorded at the same times.
+"""
+
+from copy import copy
+import hashlib
+from typing import Iterator, List, NamedTuple, Tuple
 import numpy as np
 import pandas as pd
 
+from . import instrumentation
+
+_CHUNK_SIZE = 2**20
+"""Number of timestamps to process at once when analyzing the sample rate."""
+_GROWTH_FACTOR = 2
+"""Reserve that many times the required memory when appending data."""
+_GAP_TOLERANCE = 1.05
+"""Default ratio between neighbouring sampling intervals considered regular."""
+
+
+class EquidistantIndex(NamedTuple):  # pylint: disable=too-few-public-methods
+    """An implicit time index of equidistant samples."""
+    start: int
+    """Time of the first sample in nanoseconds since the epoch."""
+    period: float
+    """Time between two samples in nanoseconds."""
+
+
 class FreqSeries:
     """A series of frequency measurements, as usually taken by a counter.
 
@@ -11,7 +34,9 @@ class FreqSeries:
     """
 
     def __init__(self, data: pd.Series, original_freq: float = None,
-                 session: str = None) -> None:
+                 session: str = None, lazy: bool = False,
+                 rate_analysis: Tuple[float, float] = None,
+                 index: EquidistantIndex = None) -> None:
         """
         :param data: The measured frequencies.
         :param original_freq: The frequency that the DUT was actually operated
@@ -26,39 +51,131 @@ class FreqSeries:
                         Especially useful when different setups are shown in
                         one plot. A separate session shoud be assigned for
                         every change in the experimental setup.
+        :param lazy: Don't analyze the sample rate right away, but on first
+                        access to `sample_rate` or `sampling_regularity`.
+        :param rate_analysis: The already known (sample rate, sampling
+                        regularity) of `data`. Skips the analysis.
+        :param index: Use this implicit index instead of `data`'s. Timestamps
+                        are then only created when accessing `data`, saving
+                        memory and making the sample rate known in advance.
         :raises ValueError: For non-equidistantly sampled data.
         """
-        if not data.index.is_monotonic_increasing:
+        if index is None and not data.index.is_monotonic_increasing:
             raise ValueError("Times are not monotonically increasing.")
+        if index is not None and not index.period > 0:
+            raise ValueError("Sampling period must be positive.")
 
         self.org_freq = original_freq
         self.session = session
-        self._data: pd.Series = data
+        self._data: pd.Series = None if index is not None else data
+        """The series, unless an implicit index is used."""
+        self._values: np.ndarray = data.values if index is not None else None
+        """The measured values if an implicit index is used."""
+        self._name = data.name
+        """Name of the series if an implicit index is used."""
+        self._index: EquidistantIndex = index
+        self._index_offset = 0
+        """Position of the first sample on the implicit index."""
 
-        rate, regularity = self._analyze_sample_rate()
-        self._rate: float = rate
+        self._rate: float = None
         """Median sample rate of the data in Hz.
+
+        `None` if the sample rate has not been analyzed yet.
         """
-        self._regularity: float = regularity
+        self._regularity: float = None
         """How much does the sample rate deviate?
 
         max((max_rate / median_rate), (median_rate / min_rate))
         """
+        self._intervals: Tuple[np.ndarray, np.ndarray] = None
+        """Histogram of sampling intervals, see `_count_intervals()`.
+
+        Is kept to incrementally update the analysis when appending.
+        """
+        self._buffers: Tuple[np.ndarray, np.ndarray] = None
+        """Preallocated (values, timestamps) buffers, as used by `append()`.
+
+        If set, `_data` is backed by the beginning of these buffers.
+        """
+        self._fingerprint: str = None
+        """Cached result of `fingerprint`."""
+        if index is not None:
+            self._rate, self._regularity = 1e9 / index.period, 1.
+        elif rate_analysis is not None:
+            self._rate, self._regularity = rate_analysis
+        elif not lazy:
+            self._rate, self._regularity = self._analyze_sample_rate()
+
+    def __len__(self) -> int:
+        return len(self.values)
 
     @property
     def data(self) -> pd.Series:
-        return self._data
+        """The measured frequencies.
+
+        If the series has an implicit index, its timestamps are created on
+        every access. Consider using `values` instead where possible.
+        """
+        if self._index is None:
+            return self._data
+        index = pd.DatetimeIndex(self._timestamps().view('datetime64[ns]'), copy=False)
+        return pd.Series(self._values, index=index, name=self._name, copy=False)
+
+    @property
+    def equidistant_index(self) -> EquidistantIndex:
+        """The implicit index, or `None` if the series has explicit timestamps.
+        """
+        if self._index is None:
+            return None
+        return EquidistantIndex(
+            self._index.start + int(round(self._index_offset * self._index.period)),
+            self._index.period)
+
+    @property
+    def name(self) -> str:
+        """Name of the series, usually given by the measurement device."""
+        return self._data.name if self._index is None else self._name
+
+    @property
+    def values(self) -> np.ndarray:
+        """The measured frequencies, without any timestamps."""
+        return self._data.values if self._index is None else self._values
 
     @property
     def duration(self) -> float:
         """Duration of the measurement in seconds."""
+        if self._index is not None:
+            return max(len(self._values) - 1, 0) * self._index.period / 1e9
         idx = self._data.index
         delta = idx[-1] - idx[0]
         return delta.total_seconds() if self._data.index.is_all_dates else delta
 
+    @property
+    def fingerprint(self) -> str:
+        """A hash identifying the data (values and times).
+
+        Is calculated once and cached, until the series is modified by its
+        methods. After modifying `data` or `values` in place, call
+        `invalidate()`. `org_freq` isn't part of the hash, as it may be
+        changed at any time.
+        """
+        if self._fingerprint is None:
+            with instrumentation.timer('freq_series.fingerprint'):
+                digest = hashlib.blake2b(np.ascontiguousarray(self.values, dtype=np.float64))
+                if self._index is not None:
+                    digest.update(repr(tuple(self.equidistant_index)).encode())
+                else:
+                    digest.update(np.ascontiguousarray(_timestamps(self._data.index)[0]))
+                self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
     @property
     def float_index(self) -> pd.Float64Index:
         """Return the index in seconds since the epoch."""
+        if self._index is not None:
+            return pd.Index(
+                self._index.start / 1e9 + self._index.period / 1e9
+                * np.arange(self._index_offset, self._index_offset + len(self._values)))
         if isinstance(self._data.index, pd.DatetimeIndex):
             return pd.to_numeric(self._data.index) / 1e9
         if isinstance(self._data.index, pd.Float64Index):
@@ -68,34 +185,341 @@ class FreqSeries:
     @property
     def sample_rate(self) -> float:
         """The rate in Hz at which the freq. measurements have been taken."""
+        if self._rate is None:
+            self._rate, self._regularity = self._analyze_sample_rate()
         return self._rate
 
     @property
     def sampling_regularity(self) -> float:
+        if self._regularity is None:
+            self._rate, self._regularity = self._analyze_sample_rate()
         return self._regularity
 
+    @instrumentation.timed
+    def append(self, samples: pd.Series) -> None:
+        """Append samples to the end of the series (in-place operation).
+
+        Memory is reserved in advance, such that the amortized cost only
+        depends on the number of appended samples, not on the series length.
+        An already performed sample rate analysis is updated the same way.
+
+        :param samples: New measurements, indexed like `data`.
+        :raises ValueError: Times are not monotonically increasing.
+        """
+        if not len(samples):
+            return
+        self._fingerprint = None
+        if self._index is not None:  # Appended samples need not be equidistant.
+            self._data = self.data
+            self._index = None
+            self._values = None
+            self._rate, self._regularity = None, None
+        times, _ = _timestamps(self._data.index)
+        new_times, _ = _timestamps(samples.index)
+        if (not samples.index.is_monotonic_increasing
+                or (len(times) and new_times[0] < times[-1])):
+            raise ValueError("Times are not monotonically increasing.")
+
+        n_old = len(self._data)
+        length = n_old + len(samples)
+        if self._buffers is None or len(self._buffers[0]) < length:
+            capacity = _GROWTH_FACTOR * length
+            buffers = (np.empty(capacity, dtype=self._data.dtype),
+                       np.empty(capacity, dtype=times.dtype))
+            buffers[0][:n_old] = self._data.values
+            buffers[1][:n_old] = times
+            self._buffers = buffers
+        values, times = self._buffers
+        values[n_old:length] = samples.values
+        times[n_old:length] = new_times
+
+        if self._intervals is not None:
+            self._intervals = _merge_counts(
+                *self._intervals, *_count_intervals(times[max(n_old - 1, 0):length]))
+            self._rate, self._regularity = self._rate_from_intervals()
+        else:  # Analyze again on demand.
+            self._rate, self._regularity = None, None
+
+        if isinstance(self._data.index, pd.DatetimeIndex):
+            index = pd.DatetimeIndex(times[:length].view('datetime64[ns]'), copy=False)
+        else:
+            index = pd.Index(times[:length], copy=False)
+        self._data = pd.Series(values[:length], index=index,
+                               name=self._data.name, copy=False)
+
+    def invalidate(self) -> None:
+        """Forget the `fingerprint`, after modifying the data in place."""
+        self._fingerprint = None
+
     def trim(self, start: int = None, end: int = None) -> None:
         """Trim some values from start and/or end (in-place operation).
 
         Does nothing, if neither `start` nor `end` are specified.
         """
+        self._buffers = None
+        self._intervals = None
+        self._fingerprint = None
+        if self._index is not None:
+            first = range(len(self._values))[start:].start
+            self._values = self._values[first:]
+            self._index_offset += first
+            if end is not None and end > 0:
+                self._values = self._values[:-end]
+            return
         if start is not None:
             self._data = self._data.iloc[start:]
         if end is not None and end > 0:
             self._data = self._data.iloc[:-end]
 
+    def view(self, start: int = None, stop: int = None) -> 'FreqSeries':
+        """Get the samples `start` to `stop` without copying any data.
+
+        The returned series shares its underlying buffer with this one and
+        inherits its sample rate analysis.
+        """
+        # Make sure the (expensive) analysis is done at most once.
+        if self._rate is None:
+            self._rate, self._regularity = self._analyze_sample_rate()
+        chop = copy(self)
+        if self._index is not None:
+            chop._values = self._values[start:stop]
+            chop._index_offset += range(len(self._values))[start:stop].start
+        else:
+            chop._data = self._data.iloc[start:stop]
+        chop._buffers = None
+        chop._intervals = None
+        chop._fingerprint = None
+        return chop
+
+    def split(self, n_chops: int) -> List['FreqSeries']:
+        """Split into `n_chops` consecutive views of equal length.
+
+        If the length of the series is not divisible by `n_chops`, neighbouring
+        views overlap by the remainder of that division.
+        """
+        return [self.view(start, stop)
+                for start, stop in split_bounds(len(self), n_chops)]
+
+    def gaps(self, tolerance: float = _GAP_TOLERANCE) -> np.ndarray:
+        """Find gaps in the sampling and changes of the sample rate.
+
+        :param tolerance: Sampling intervals are considered irregular if they
+                    are more than this factor longer or shorter than the
+                    preceding interval.
+        :returns: Positions `k` of all irregular intervals, each of which lies
+                    between samples `k` and `k + 1`.
+        """
+        if self._index is not None:  # Equidistant by definition.
+            return np.empty(0, dtype=np.int64)
+        timestamps, _ = _timestamps(self._data.index)
+        return _irregular_intervals(timestamps, tolerance)
+
+    def segment_bounds(self, tolerance: float = _GAP_TOLERANCE,
+                       min_length: int = 3) -> List[Tuple[int, int]]:
+        """(start, stop) indices of the views returned by `segments()`."""
+        if not len(self):
+            return []
+        breaks = self.gaps(tolerance)
+        # Runs of similar intervals, each starting at an irregular one.
+        starts = np.concatenate(([0], breaks))
+        stops = np.concatenate((breaks, [max(len(self) - 1, 0)])) + 1
+        return [(int(start), int(stop)) for start, stop in zip(starts, stops)
+                if stop - start >= min_length]
+
+    def segments(self, tolerance: float = _GAP_TOLERANCE,
+                 min_length: int = 3) -> List['FreqSeries']:
+        """Split into contiguous, regularly sampled views.
+
+        A single irregular interval (a gap) ends a segment, the next one
+        starting after the gap. A lasting change of the sample rate starts a
+        new segment, neighbouring segments then share the sample at the
+        change. Every segment gets its own sample rate analysis.
+
+        :param tolerance: See `gaps()`.
+        :param min_length: Omit segments with fewer samples. The default
+                    omits the two samples enclosing a gap.
+        """
+        segments = []
+        for start, stop in self.segment_bounds(tolerance, min_length):
+            segment = self.view(start, stop)
+            if self._index is None:
+                segment._rate, segment._regularity = None, None
+            segments.append(segment)
+        return segments
+
+    def _timestamps(self) -> np.ndarray:
+        """Create the timestamps of an implicit index, in ns since the epoch."""
+        positions = np.arange(self._index_offset,
+                              self._index_offset + len(self._values))
+        return self._index.start + np.round(
+            positions * self._index.period).astype(np.int64)
+
+    @instrumentation.timed
     def _analyze_sample_rate(self) -> Tuple[float, float]:
         """
         :returns: (median rate in Hz, rate regularity)
         :raises ValueError: The sample rate is not uniform.
         """
-        # Assume seconds (as float),
-        timestamps = self._data.index
-        # except if the index is a DatetimeIndex.
-        if self._data.index.is_all_dates:
-            timestamps = [date.timestamp() for date in self._data.index]
+        timestamps, _ = _timestamps(self._data.index)
+        self._intervals = _count_intervals(timestamps)
+        return self._rate_from_intervals()
+
+    def _rate_from_intervals(self) -> Tuple[float, float]:
+        """Evaluate the histogram of sampling intervals.
 
-        times = np.diff(timestamps)
-        median = np.median(times)
-        uniformity = max(np.max(times) / median, median / np.min(times))
+        :returns: (median rate in Hz, rate regularity), both NaN for less than
+                two samples.
+        """
+        intervals, counts = self._intervals
+        if not len(intervals):
+            return (np.nan, np.nan)
+        _, seconds_per_unit = _timestamps(self._data.index)
+        median = _median(intervals, counts) * seconds_per_unit
+        uniformity = max(intervals[-1] * seconds_per_unit / median,
+                         median / (intervals[0] * seconds_per_unit))
         return (1/float(median), float(uniformity))
+
+
+class MultiChannelSeries:
+    """Frequency series of several channels sharing the same time index.
+
+    The values are kept in one column-major 2D array, such that every channel
+    is contiguous in memory and available as a `FreqSeries` without copying.
+    The sample rate is analyzed only once for all channels.
+    """
+
+    def __init__(self, data: pd.DataFrame, original_freq: float = None,
+                 session: str = None, index: EquidistantIndex = None) -> None:
+        """
+        :param data: One column per channel.
+        :param original_freq: See `FreqSeries`. Applies to all channels.
+        :param session: See `FreqSeries`.
+        :param index: Implicit index to use instead of the index of `data`,
+                    see `FreqSeries`.
+        """
+        self.org_freq = original_freq
+        self.session = session
+        self.values: np.ndarray = np.asfortranarray(data.values, dtype=np.float64)
+        """The measured frequencies, of shape (samples, channels)."""
+        self.names = list(data.columns)
+        """Name of each channel."""
+        self._times: pd.Index = data.index if index is None else None
+        self._index: EquidistantIndex = index
+        self._rate_analysis: Tuple[float, float] = None
+        """(sample rate, regularity) shared by all channels, once analyzed."""
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __iter__(self) -> Iterator[FreqSeries]:
+        return (self.channel(idx) for idx in range(self.n_channels))
+
+    @property
+    def n_channels(self) -> int:
+        return self.values.shape[1]
+
+    @property
+    def sample_rate(self) -> float:
+        return self.channel(0).sample_rate
+
+    @property
+    def sampling_regularity(self) -> float:
+        return self.channel(0).sampling_regularity
+
+    def channel(self, idx: int) -> FreqSeries:
+        """Get a single channel, sharing its data with this series."""
+        data = pd.Series(self.values[:, idx], index=self._times,
+                         name=self.names[idx], copy=False)
+        if self._index is not None:
+            return FreqSeries(data, original_freq=self.org_freq,
+                              session=self.session, index=self._index)
+        series = FreqSeries(data, original_freq=self.org_freq, session=self.session,
+                            lazy=True, rate_analysis=self._rate_analysis)
+        if self._rate_analysis is None:
+            self._rate_analysis = (series.sample_rate, series.sampling_regularity)
+        return series
+
+
+def split_bounds(length: int, n_chops: int) -> List[Tuple[int, int]]:
+    """(start, stop) indices of the views returned by `FreqSeries.split()`."""
+    slice_length = int(length / n_chops)
+    return [(idx * slice_length, length - (n_chops - idx - 1) * slice_length)
+            for idx in range(n_chops)]
+
+
+def _nanoseconds(index: pd.DatetimeIndex) -> np.ndarray:
+    """Zero-copy int64 view of a datetime index, in nanoseconds since epoch."""
+    return index.values.astype('datetime64[ns]', copy=False).view(np.int64)
+
+
+def _timestamps(index: pd.Index) -> Tuple[np.ndarray, float]:
+    """Get the raw timestamps of an index without converting them.
+
+    :returns: (timestamps, their unit in seconds)
+    """
+    if isinstance(index, pd.DatetimeIndex):
+        # Work on the integer nanoseconds, avoiding any float conversion.
+        return _nanoseconds(index), 1e-9
+    return index.values, 1.  # Assume seconds (as float).
+
+
+def _count_intervals(timestamps: np.ndarray,
+                     chunk_size: int = _CHUNK_SIZE) -> Tuple[np.ndarray, np.ndarray]:
+    """Histogram the sampling intervals of a series of timestamps.
+
+    The timestamps are processed in chunks, to keep memory usage low. As
+    counters sample at very few distinct intervals, the resulting histogram is
+    usually tiny.
+
+    :returns: (sorted distinct intervals, number of occurences of each)
+    """
+    intervals = np.empty(0, dtype=timestamps.dtype)
+    counts = np.empty(0, dtype=np.int64)
+    for start in range(0, len(timestamps) - 1, chunk_size):
+        # Chunks overlap by one sample, as to not miss any interval.
+        chunk_intervals, chunk_counts = np.unique(
+            np.diff(timestamps[start:start + chunk_size + 1]), return_counts=True)
+        intervals, counts = _merge_counts(intervals, counts,
+                                          chunk_intervals, chunk_counts)
+    return intervals, counts
+
+
+def _irregular_intervals(timestamps: np.ndarray, tolerance: float,
+                         chunk_size: int = _CHUNK_SIZE) -> np.ndarray:
+    """Positions of the intervals differing from their predecessor by more
+    than the factor `tolerance`, see `FreqSeries.gaps()`.
+
+    The timestamps are processed in chunks, like in `_count_intervals()`.
+    """
+    breaks = [np.empty(0, dtype=np.int64)]
+    for start in range(1, len(timestamps) - 1, chunk_size):
+        # Start one interval early, to compare every interval to its predecessor.
+        intervals = np.diff(timestamps[start - 1:start + chunk_size + 1]).astype(float)
+        ratios = intervals[1:] / intervals[:-1]
+        breaks.append(start + np.flatnonzero(
+            (ratios > tolerance) | (ratios < 1 / tolerance)))
+    return np.concatenate(breaks)
+
+
+def _merge_counts(values: np.ndarray, counts: np.ndarray,
+                  other_values: np.ndarray,
+                  other_counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Merge two histograms as returned by `np.unique(..., return_counts=True)`.
+    """
+    merged, inverse = np.unique(np.concatenate((values, other_values)),
+                                return_inverse=True)
+    merged_counts = np.zeros(len(merged), dtype=np.int64)
+    np.add.at(merged_counts, inverse.ravel(), np.concatenate((counts, other_counts)))
+    return merged, merged_counts
+
+
+def _median(values: np.ndarray, counts: np.ndarray) -> float:
+    """Median of a histogram as returned by `np.unique(..., return_counts=True)`.
+
+    Equals the median of the original data, as computed by `np.median()`.
+    """
+    cumulative = np.cumsum(counts)
+    total = cumulative[-1]
+    lower = values[np.searchsorted(cumulative, (total - 1) // 2, side='right')]
+    upper = values[np.searchsorted(cumulative, total // 2, side='right')]
+    return (float(lower) + float(upper)) / 2
@@ -0,0 +1,131 @@
+"""Opt-in timers and counters for finding out where time is spent.
+
+Instrumentation is off by default and then costs no more than a function call
+per instrumented stage. Enable it by calling `enable()`, by using the
+`recording()` context or by setting the `FREQLE_INSTRUMENT` environment
+variable to "1":
+
+    with instrumentation.recording() as report:
+        statistics.deviation(parsers.fokus2_txt('data.txt'))
+    print(report())
+
+Stages are named like "module.function[.part]", e.g. "parsers.fokus2_txt",
+"parsers.read_csv" or "statistics.deviation.chops". Their timings are
+inclusive, such that nested stages add up to less than their parent.
+
+Counters include
+  - bytes_parsed, samples_parsed: Input read by parsers.
+  - samples_processed, taus_evaluated: Work done by deviations and ASDs.
+  - series_cache_hits/misses, result_cache_hits/misses: See the `cache`
+    module.
+
+Chunked parsers return iterators, so their stage only covers creating the
+iterator. Their counters are updated as the chunks are consumed, though.
+
+Only the current process is instrumented. Work done in worker processes (see
+`parallel`) shows up as part of the stage that dispatched it.
+"""
+from contextlib import contextmanager, nullcontext
+import functools
+import json
+import os
+import time
+from typing import Any, Callable, ContextManager, Dict, Iterator, List
+
+_enabled = os.environ.get('FREQLE_INSTRUMENT') == '1'
+_timings: Dict[str, List[float]] = {}
+"""Number of calls and total duration in seconds, by stage."""
+_counters: Dict[str, int] = {}
+_DISABLED = nullcontext()
+
+
+def enable() -> None:
+    """Start recording timings and counts."""
+    global _enabled  # pylint: disable=global-statement
+    _enabled = True
+
+
+def disable() -> None:
+    """Stop recording. Timings and counts so far are kept, see `reset()`."""
+    global _enabled  # pylint: disable=global-statement
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset() -> None:
+    """Discard all timings and counts."""
+    _timings.clear()
+    _counters.clear()
+
+
+@contextmanager
+def recording() -> Iterator[Callable[[], Dict[str, Any]]]:
+    """Record from scratch for the duration of the context.
+
+    :returns: The `report` function.
+    """
+    was_enabled = _enabled
+    reset()
+    enable()
+    try:
+        yield report
+    finally:
+        if not was_enabled:
+            disable()
+
+
+def count(counter: str, amount: int = 1) -> None:
+    """Increase `counter` by `amount`."""
+    if _enabled:
+        _counters[counter] = _counters.get(counter, 0) + amount
+
+
+def timer(stage: str) -> ContextManager:
+    """Time the code executed in this context as `stage`."""
+    return _timer(stage) if _enabled else _DISABLED
+
+
+def timed(func: Callable) -> Callable:
+    """Time every call of `func` as stage "module.function"."""
+    stage = '{}.{}'.format(func.__module__.rsplit('.', 1)[-1], func.__qualname__)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return func(*args, **kwargs)
+        with _timer(stage):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def report() -> Dict[str, Any]:
+    """All timings and counts recorded so far.
+
+    :returns: A dict holding "timings" (calls and seconds by stage, slowest
+                stage first) and "counters".
+    """
+    stages = sorted(_timings.items(), key=lambda item: item[1][1], reverse=True)
+    return {'timings': {stage: {'calls': int(calls), 'seconds': seconds}
+                        for stage, (calls, seconds) in stages},
+            'counters': dict(sorted(_counters.items()))}
+
+
+def export(file_name: str) -> None:
+    """Write `report()` to `file_name` as JSON."""
+    with open(file_name, 'w') as file:
+        json.dump(report(), file, indent=2)
+        file.write('\n')
+
+
+@contextmanager
+def _timer(stage: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing = _timings.setdefault(stage, [0, 0.])
+        timing[0] += 1
+        timing[1] += time.perf_counter() - start
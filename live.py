@@ -0,0 +1,263 @@
+"""Acquire frequency readings from a live stream, e.g. a counter on a socket.
+
+The stream carries lines of whitespace-separated numbers, like the files read
+by `parsers.generic_freq_counter()`: a timestamp followed by one frequency per
+channel. Any `asyncio.StreamReader` will do, e.g. from a TCP connection or a
+serial port (using the `pyserial-asyncio` package).
+
+`Acquisition` reads the stream in large batches and decodes each batch at once
+into a preallocated ring buffer. Reading and decoding are decoupled by a
+bounded queue. If decoding falls behind, reading stops, and (for TCP) the
+sender is slowed down by flow control. Analyses get snapshots of the latest
+data as `FreqSeries`, see `Acquisition.publish()`:
+
+    acquisition = live.Acquisition(capacity=10**6)
+    reader, _ = await asyncio.open_connection('counter.local', 5025)
+    await asyncio.gather(
+        acquisition.ingest(reader),
+        acquisition.publish(lambda mmt: print(statistics.deviation(mmt)), 10))
+
+`serve_replay()` streams a recorded series, standing in for a real counter.
+"""
+import asyncio
+from concurrent.futures import Executor
+import io
+from typing import Any, Callable, Tuple, Union
+import numpy as np
+import pandas as pd
+
+from . import instrumentation
+from .freq_series import FreqSeries, MultiChannelSeries
+
+_READ_SIZE = 2**16
+"""Number of bytes to read from the stream at once."""
+_MAX_PENDING = 16
+"""Number of read batches to queue for decoding, before reading pauses."""
+_NS_PER_UNIT = {'s': 10**9, 'ms': 10**6, 'us': 10**3, 'ns': 1}
+
+
+class RingBuffer:
+    """The latest `capacity` timestamped samples, older ones being overwritten.
+    """
+
+    def __init__(self, capacity: int, n_channels: int = 1) -> None:
+        self.capacity = capacity
+        self.times = np.empty(capacity, dtype=np.int64)
+        """Timestamps in nanoseconds since the epoch."""
+        self.values = np.empty((capacity, n_channels))
+        self.n_written = 0
+        """Number of samples written in total."""
+
+    def __len__(self) -> int:
+        return min(self.n_written, self.capacity)
+
+    def extend(self, times: np.ndarray, values: np.ndarray) -> None:
+        """Append samples, overwriting the oldest ones if necessary.
+
+        :param times: Timestamps in nanoseconds since the epoch.
+        :param values: Array of shape (samples, channels).
+        """
+        n_new = len(times)
+        if n_new > self.capacity:  # Only the latest ones would survive anyway.
+            times, values = times[-self.capacity:], values[-self.capacity:]
+        position = (self.n_written + n_new - len(times)) % self.capacity
+        first = min(len(times), self.capacity - position)
+        self.times[position:position + first] = times[:first]
+        self.values[position:position + first] = values[:first]
+        self.times[:len(times) - first] = times[first:]
+        self.values[:len(times) - first] = values[first:]
+        self.n_written += n_new
+
+    def latest(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Copy all samples held, oldest first.
+
+        :returns: (timestamps, values) like passed to `extend()`.
+        """
+        length = len(self)
+        start = (self.n_written - length) % self.capacity
+        n_wrapped = max(start + length - self.capacity, 0)
+        return (np.concatenate((self.times[start:start + length], self.times[:n_wrapped])),
+                np.concatenate((self.values[start:start + length],
+                                self.values[:n_wrapped])))
+
+
+class Acquisition:
+    """Ingests a stream of counter readings into a `RingBuffer`."""
+
+    def __init__(self, capacity: int = 2**20, n_channels: int = 1,
+                 time_unit: str = 's', origin: pd.Timestamp = None,
+                 session: str = None, original_freq: float = None) -> None:
+        """
+        :param capacity: Number of samples to keep.
+        :param n_channels: Number of frequency columns following the time.
+        :param time_unit: Unit of the timestamps (s, ms, us, ns).
+        :param origin: The time the timestamps count from. Defaults to the
+                    epoch, but note that the sent numbers are read as floats:
+                    Timestamps relative to a recent origin are more precise.
+        :param session: Passed to the published `FreqSeries`.
+        :param original_freq: Passed to the published `FreqSeries`.
+        """
+        self.buffer = RingBuffer(capacity, n_channels)
+        self.session = session
+        self.original_freq = original_freq
+        self._ns_per_unit = _NS_PER_UNIT[time_unit]
+        self._origin = 0 if origin is None else pd.Timestamp(origin).value
+        self._done = asyncio.Event()
+
+    @property
+    def done(self) -> bool:
+        """Has the stream ended?"""
+        return self._done.is_set()
+
+    async def ingest(self, reader: asyncio.StreamReader) -> None:
+        """Read and decode the stream until it ends.
+
+        :raises ValueError: The stream holds malformed lines.
+        """
+        batches: asyncio.Queue = asyncio.Queue(maxsize=_MAX_PENDING)
+        decoder = asyncio.ensure_future(self._decode(batches))
+        try:
+            rest = b''
+            while True:
+                chunk = await reader.read(_READ_SIZE)
+                if not chunk:
+                    break
+                # Only decode complete lines, keeping the rest for later.
+                data = rest + chunk
+                end = data.rfind(b'\n') + 1
+                rest = data[end:]
+                if end:
+                    await _enqueue(batches, data[:end], decoder)
+            if rest.strip():
+                await _enqueue(batches, rest, decoder)
+            await _enqueue(batches, None, decoder)
+            await decoder
+        finally:
+            decoder.cancel()
+            self._done.set()
+
+    def snapshot(self) -> Union[FreqSeries, MultiChannelSeries, None]:
+        """The samples currently held, as independent copy.
+
+        :returns: A `FreqSeries` or, for several channels, a
+                    `MultiChannelSeries`. `None` if there is no data yet.
+        """
+        if not len(self.buffer):
+            return None
+        times, values = self.buffer.latest()
+        index = pd.DatetimeIndex(times.view('datetime64[ns]'))
+        if values.shape[1] == 1:
+            return FreqSeries(pd.Series(values[:, 0], index=index, copy=False),
+                              original_freq=self.original_freq,
+                              session=self.session, lazy=True)
+        return MultiChannelSeries(pd.DataFrame(values, index=index, copy=False),
+                                  original_freq=self.original_freq,
+                                  session=self.session)
+
+    async def publish(self, consumer: Callable[[Any], Any], interval: float,
+                      executor: Executor = None) -> None:
+        """Pass a `snapshot()` to `consumer` every `interval` seconds.
+
+        The consumer is run in `executor` (default: the event loop's), such
+        that analyses don't block the acquisition. If it is still busy with
+        the previous snapshot, the current one is skipped. A last snapshot is
+        published once the stream has ended.
+        """
+        loop = asyncio.get_event_loop()
+        running: asyncio.Future = None
+        while True:
+            try:
+                await asyncio.wait_for(self._done.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            if self.done:
+                break
+            if running is not None and not running.done():
+                continue
+            mmt = self.snapshot()
+            if mmt is not None:
+                running = loop.run_in_executor(executor, consumer, mmt)
+        if running is not None:
+            await running
+        mmt = self.snapshot()
+        if mmt is not None:
+            await loop.run_in_executor(executor, consumer, mmt)
+
+    async def _decode(self, batches: asyncio.Queue) -> None:
+        while True:
+            batch = await batches.get()
+            if batch is None:
+                return
+            rows = decode_lines(batch, self.buffer.values.shape[1] + 1)
+            times = self._origin + np.round(rows[:, 0] * self._ns_per_unit).astype(np.int64)
+            self.buffer.extend(times, rows[:, 1:])
+            instrumentation.count('bytes_parsed', len(batch))
+            instrumentation.count('samples_parsed', len(rows))
+
+
+async def _enqueue(batches: asyncio.Queue, batch: bytes, decoder: asyncio.Future) -> None:
+    """Put `batch` into the queue, unless (and raising if) the decoder failed."""
+    put = asyncio.ensure_future(batches.put(batch))
+    await asyncio.wait((put, decoder), return_when=asyncio.FIRST_COMPLETED)
+    if not put.done():
+        put.cancel()
+        decoder.result()
+
+
+def decode_lines(batch: bytes, n_columns: int) -> np.ndarray:
+    """Decode lines of whitespace-separated numbers into a 2D array.
+
+    :raises ValueError: Some lines don't hold `n_columns` numbers. Note that
+                NaNs are taken for missing numbers, too.
+    """
+    if not batch.strip():
+        return np.empty((0, n_columns))
+    try:
+        rows = pd.read_csv(io.BytesIO(batch), sep=r'\s+', header=None,
+                           dtype=np.float64).values
+    except ValueError as err:  # Includes pandas' parser errors.
+        raise ValueError("Malformed counter data: {}".format(err)) from err
+    if rows.shape[1] != n_columns or np.isnan(rows).any():
+        raise ValueError("Malformed counter data, expected {} columns.".format(n_columns))
+    return rows
+
+
+async def serve_replay(measurement: FreqSeries, host: str = '127.0.0.1',
+                       port: int = 0, speed: float = 1.,
+                       batch_size: int = 2**12) -> asyncio.AbstractServer:
+    """Stream a recorded series to every client connecting, like a counter.
+
+    Every line holds the time in seconds since the first sample (use that as
+    `Acquisition`'s `origin`), followed by the value.
+
+    :param port: 0 picks a free port, see the returned server's `sockets`.
+    :param speed: Replay that many times faster than recorded. `inf` sends as
+                fast as the client reads.
+    :param batch_size: Number of lines to send at once.
+    """
+    offsets = measurement.data.index - measurement.data.index[0]
+    seconds = (offsets.total_seconds() if isinstance(offsets, pd.TimedeltaIndex)
+               else offsets).values
+    # Render the text beforehand, to be able to send faster than decoding.
+    batches = ['\n'.join('{:.9f}\t{:.6f}'.format(*line) for line in zip(
+        seconds[first:first + batch_size],
+        measurement.values[first:first + batch_size])).encode() + b'\n'
+               for first in range(0, len(seconds), batch_size)]
+    period = batch_size / measurement.sample_rate / speed
+
+    async def replay(_: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        try:
+            for idx, batch in enumerate(batches):
+                writer.write(batch)
+                await writer.drain()  # Honor the client's backpressure.
+                delay = start + (idx + 1) * period - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+        except ConnectionError:  # The client hung up.
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(replay, host, port)
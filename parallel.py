@@ -0,0 +1,123 @@
+"""Run calculations concurrently.
+
+`map_slices()` works on slices of one array. The array is transferred to
+worker processes via shared memory, such that every worker reads the same
+buffer instead of receiving a pickled copy.
+
+`map_bounded()` works on independent inputs, limiting the number of them being
+processed (and thus held in memory) at once.
+"""
+from concurrent.futures import Executor, FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import contextmanager
+import os
+from multiprocessing import shared_memory
+from typing import Any, Callable, Iterator, List, NamedTuple, Sequence, Tuple
+import numpy as np
+
+Task = Tuple[int, int, tuple]
+"""A calculation on `array[start:stop]`, given as (start, stop, extra args)."""
+
+
+class SharedArray(NamedTuple):  # pylint: disable=too-few-public-methods
+    """A picklable handle to an array living in shared memory."""
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+    order: str = 'C'
+    """Memory layout of the array, "C" (row-major) or "F" (column-major)."""
+
+
+def map_slices(func: Callable, array: np.ndarray, tasks: Sequence[Task],
+               executor: Executor = None, n_jobs: int = None) -> List[Any]:
+    """Call `func(array[start:stop], *args)` for every task.
+
+    If neither `executor` nor `n_jobs` is given, all tasks are run serially in
+    this process. The results are returned in the order of `tasks` in any case
+    and don't depend on the way they were calculated.
+
+    :param executor: Run the tasks in this executor.
+    :param n_jobs: Run the tasks in a pool of that many processes. Ignored if
+                `executor` is given.
+    """
+    if executor is None and n_jobs is None:
+        return [func(array[start:stop], *args) for start, stop, args in tasks]
+
+    with _pool(executor, n_jobs) as pool, share(array) as handle:
+        futures = [pool.submit(_call_on_slice, func, handle, start, stop, args)
+                   for start, stop, args in tasks]
+        return [future.result() for future in futures]
+
+
+def map_bounded(func: Callable, args: Sequence[tuple], executor: Executor = None,
+                n_jobs: int = None, max_pending: int = None) -> List[Any]:
+    """Call `func(*arg)` for every item of `args`.
+
+    Like in `map_slices()`, the calls are run serially if neither `executor`
+    nor `n_jobs` is given, and results are returned in the order of `args`.
+
+    :param max_pending: Submit at most that many calls at once. Defaults to
+                twice the number of processes.
+    """
+    if executor is None and n_jobs is None:
+        return [func(*arg) for arg in args]
+
+    results: List[Any] = [None] * len(args)
+    with _pool(executor, n_jobs) as pool:
+        if max_pending is None:
+            max_pending = 2 * (n_jobs or os.cpu_count() or 1)
+        pending = {}
+        for idx, arg in enumerate(args):
+            if len(pending) >= max_pending:
+                _collect(pending, results)
+            pending[pool.submit(func, *arg)] = idx
+        while pending:
+            _collect(pending, results)
+    return results
+
+
+@contextmanager
+def share(array: np.ndarray) -> Iterator[SharedArray]:
+    """Copy `array` to shared memory for the duration of the context.
+
+    Column-major arrays keep their layout, such that calculations on the shared
+    copy sum up in the same order (and give the same results) as on `array`.
+    """
+    order = 'F' if array.flags.f_contiguous and not array.flags.c_contiguous else 'C'
+    memory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    try:
+        np.ndarray(array.shape, array.dtype, buffer=memory.buf, order=order)[...] = array
+        yield SharedArray(memory.name, array.shape, array.dtype.str, order)
+    finally:
+        memory.close()
+        memory.unlink()
+
+
+@contextmanager
+def _pool(executor: Executor = None, n_jobs: int = None) -> Iterator[Executor]:
+    """Use `executor` or, if not given, a temporary process pool."""
+    if executor is not None:
+        yield executor
+        return
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        yield pool
+
+
+def _collect(pending: dict, results: List[Any]) -> None:
+    """Wait for some of the `pending` futures and store their results."""
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    for future in done:
+        results[pending.pop(future)] = future.result()
+
+
+def _call_on_slice(func: Callable, handle: SharedArray, start: int, stop: int,
+                   args: tuple) -> Any:
+    memory = shared_memory.SharedMemory(name=handle.name)
+    try:
+        array = np.ndarray(handle.shape, handle.dtype, buffer=memory.buf,
+                           order=handle.order)
+        result = func(array[start:stop], *args)
+        # The buffer can only be released once no views on it are left.
+        del array
+        return result
+    finally:
+        memory.close()
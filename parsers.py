@@ -1,79 +1,235 @@
-"""Parse output from various sources into `FreqSeries` objects."""
-from typing import List
+"""Parse output from various sources into `FreqSeries` objects.
+
+Every parser reads its file only once. If given a `chunksize`, parsers return
+an iterator of consecutive `FreqSeries` instead, each containing (at most)
+that many samples. This is useful for files that don't fit into memory, see
+e.g. `statistics.deviation_streaming()`.
+
+Parsed series are cached on disk, see the `cache` module. Parsing is
+instrumented, see the `instrumentation` module.
+
+The `engine` parameter selects the pandas CSV parser to use. While "c" is the
+default, recent pandas versions offer the faster "pyarrow" engine (which
+doesn't support chunked reading).
+"""
+from contextlib import nullcontext
+import os
+from typing import IO, BinaryIO, Callable, ContextManager, Iterator, List, Optional, Union
+import numpy as np
 import pandas as pd
 
-from .freq_series import FreqSeries
+from . import instrumentation
+from .cache import cached
+from .freq_series import EquidistantIndex, FreqSeries, MultiChannelSeries
+
+Parsed = Union[FreqSeries, MultiChannelSeries,
+               Iterator[FreqSeries], Iterator[MultiChannelSeries]]
+"""A whole series or, if chunked, an iterator of consecutive ones."""
 
+_DEFAULT_ENGINE = 'c'
+_TAIL_SIZE = 4096
+"""Number of bytes to read at once when looking for the last line of a file."""
 
+
+@instrumentation.timed
+@cached
 def fokus2_txt(file_name: str, session: str = None,
-               drop_lines: List[int] = None) -> FreqSeries:
+               drop_lines: List[int] = None, chunksize: int = None,
+               engine: str = _DEFAULT_ENGINE) -> Parsed:
     """Parse frequency measurement done by the FOKUS2 Dual frequency comb.
 
     :param session: Measurement context. See `FreqSeries`'s `session` param.
+    :param drop_lines: Indices of samples to drop. Negative indices count from
+                the end, which isn't supported when parsing in chunks.
+    :raises ValueError: Negative `drop_lines` were given along with a
+                `chunksize`.
     """
-    data = pd.read_table(file_name, squeeze=True, index_col=0, usecols=[0, 1])
-    if drop_lines is not None:
-        data.drop(data.index[drop_lines], inplace=True)
-    data.index = pd.to_datetime(data.index, unit='us')
-    with open(file_name) as file:
-        data.name = file.readline().strip()
-    return FreqSeries(data, session=session)
+    if (chunksize is not None and drop_lines is not None
+            and np.any(np.asarray(drop_lines) < 0)):
+        raise ValueError("Negative drop_lines need the whole file, not chunks.")
+
+    def convert(data: pd.Series, header: str, offset: int) -> FreqSeries:
+        if drop_lines is not None:
+            positions = np.asarray(drop_lines)
+            if chunksize is None:  # Resolve negative indices.
+                positions = np.where(positions < 0, positions + len(data), positions)
+            positions = positions - offset
+            positions = positions[(positions >= 0) & (positions < len(data))]
+            data.drop(data.index[positions], inplace=True)
+        with instrumentation.timer('parsers.to_datetime'):
+            data.index = pd.to_datetime(data.index, unit='us')
+        data.name = header.strip()
+        return FreqSeries(data, session=session)
+
+    return _parse(file_name, convert, chunksize, engine, sep='\t',
+                  header=None, index_col=0, usecols=[0, 1])
 
 
+@instrumentation.timed
+@cached
 def generic_freq_counter(
-        file_name: str, session: str = None,
-        time_unit: str = 's', original_freq: float = None) -> FreqSeries:
+        file_name: Union[str, IO], session: str = None,
+        time_unit: str = 's', original_freq: float = None,
+        chunksize: int = None, engine: str = _DEFAULT_ENGINE) -> Parsed:
     """Parse a generic two-column counter file like (time, frequency).
-    :param file_name: File to read from.
+    :param file_name: File to read from. Can also be an open file (or any
+                buffer pandas can read), which bypasses the cache.
     :param time_unit: Which unit does the counter count time in? (s, ms, us, ns)
     """
-    data = pd.read_table(file_name, squeeze=True, index_col=0, usecols=[0, 1])
-    data.index = pd.to_datetime(data.index, unit=time_unit)
-    return FreqSeries(data, session=session, original_freq=original_freq)
+    def convert(data: pd.Series, header: str, _: int) -> FreqSeries:
+        with instrumentation.timer('parsers.to_datetime'):
+            data.index = pd.to_datetime(data.index, unit=time_unit)
+        data.name = header.rstrip('\r\n').split('\t')[1]
+        return FreqSeries(data, session=session, original_freq=original_freq)
 
+    return _parse(file_name, convert, chunksize, engine, sep='\t',
+                  header=None, index_col=0, usecols=[0, 1])
 
-def pendulum_cnt91_txt(file_name: str, session: str = None) -> FreqSeries:
+
+@instrumentation.timed
+@cached
+def pendulum_cnt91_txt(file_name: str, session: str = None,
+                       chunksize: int = None,
+                       engine: str = _DEFAULT_ENGINE) -> Parsed:
     """Parse frequency measurement done with a Pendulum CNT 91 counter.
 
     :param session: Measurement context. See `FreqSeries`'s `session` param.
     """
-    def get_start_time(file_name: str) -> pd.datetime:
-        """Get the measurement starting time from a CNT-91 CSV file."""
-        time_string = _get_info(file_name)[21:40]
-        return pd.to_datetime(time_string)
-
-    def _get_info(file_name: str) -> str:
-        with open(file_name) as file:
-            info = file.readline().replace('\t', ' ').strip()
-        return info
+    def convert(data: pd.Series, header: str, _: int) -> FreqSeries:
+        info = header.replace('\t', ' ').strip()
+        # The measurement starting time is part of the info line.
+        with instrumentation.timer('parsers.to_datetime'):
+            data.index = pd.to_datetime(data.index, unit='s',
+                                        origin=pd.to_datetime(info[21:40]))
+        data.name = info
+        return FreqSeries(data, session=session)
 
-    data = pd.read_table(file_name, squeeze=True, index_col=0, usecols=[0, 1])
-    data.index = pd.to_datetime(data.index, unit='s',
-                                origin=get_start_time(file_name))
-    data.name = _get_info(file_name)
-    return FreqSeries(data, session=session)
+    return _parse(file_name, convert, chunksize, engine, sep='\t',
+                  header=None, index_col=0, usecols=[0, 1])
 
 
+@instrumentation.timed
+@cached
 def menlo_lambda_freq_counter(file_name: str, session_name: str,
-                              original_freq: float, series: int = 1) -> FreqSeries:
+                              original_freq: float, series: Optional[int] = 1,
+                              chunksize: int = None,
+                              engine: str = _DEFAULT_ENGINE) -> Parsed:
+    """
+    :param series: Which of the recorded time series to use? `None` reads all
+                of them at once into a `MultiChannelSeries`, its channels
+                being named by their series number.
+    :param chunksize: See module docstring. Chunked parsing needs to count the
+                lines of the file beforehand, which is a lot faster than
+                parsing it but still requires reading it.
     """
-    :param series: Which of the recorded time series to use?
+    def get_time(line: str) -> pd.Timestamp:
+        date, time = line.split()[:2]
+        return pd.to_datetime("{} {}".format(date, time),
+                              format='%y%m%d %H%M%S.%f')
+
+    with open(file_name, 'rb') as file:
+        # The file has no header, so its first line is the first sample.
+        first_line = file.readline().decode()
+        start = get_time(first_line)
+        end = get_time(_last_line(file).decode())
+        n_samples = _count_lines(file) if chunksize is not None else None
+
+    # Use an implicit, equidistant time stamp index, as the values in the
+    # Menlo counter file are garbage.
+    def convert(data: Union[pd.Series, pd.DataFrame], _: str,
+                offset: int) -> Union[FreqSeries, MultiChannelSeries]:
+        period = (end - start).value / ((n_samples or len(data)) - 1)
+        index = EquidistantIndex(start.value + int(round(offset * period)), period)
+        if series is None:
+            data.columns = data.columns - 2
+            return MultiChannelSeries(data, session=session_name,
+                                      original_freq=original_freq, index=index)
+        return FreqSeries(data, session=session_name, original_freq=original_freq,
+                          index=index)
+
+    columns = ([2 + series] if series is not None
+               else list(range(2, len(first_line.split()))))
+    return _parse(file_name, convert, chunksize, engine, header_lines=0,
+                  squeeze=series is not None, sep=r'\s+', header=None,
+                  usecols=columns)
+
+
+def _parse(file_name: Union[str, IO], convert: Callable[[pd.Series, str, int], FreqSeries],
+           chunksize: int = None, engine: str = _DEFAULT_ENGINE,
+           header_lines: int = 1, squeeze: bool = True, **read_args) -> Parsed:
+    """Read a counter file in a single pass.
+
+    :param convert: Turns the raw data into a `FreqSeries`, being called like
+                `convert(data, header, offset)` for the whole file or every
+                chunk. `header` is the header line (if any) and `offset` the
+                number of samples preceding `data` in the file.
+    :param file_name: Path or open file (or other buffer) to read from.
+    :param header_lines: Number of header lines preceding the data, 0 or 1.
+    :param squeeze: Pass the single column read as `pd.Series` to `convert`.
+                Otherwise, all columns are passed as `pd.DataFrame`.
+    :param read_args: Passed to `pandas.read_csv`.
     """
-    data = pd.read_csv(file_name, delim_whitespace=True, usecols=[2 + series],
-                       header=None, squeeze=True)
-
-    # Create an equidistand time stamp index, as the values in the Menlo
-    # counter file are garbage.
-    first_sample = pd.read_csv(file_name, delim_whitespace=True,
-                               usecols=[0, 1], header=None,
-                               nrows=1).applymap(str).values
-    last_sample = pd.read_csv(file_name, delim_whitespace=True,
-                              usecols=[0, 1], header=None,
-                              skiprows=len(data) - 1).applymap(str).values
-    start = pd.to_datetime("{} {}".format(first_sample[0][0], first_sample[0][1]),
-                           format='%y%m%d %H%M%S.%f')
-    end = pd.to_datetime("{} {}".format(last_sample[0][0], last_sample[0][1]),
-                         format='%y%m%d %H%M%S.%f')
-    data.index = pd.date_range(start, end, len(data))
-
-    return FreqSeries(data, session=session_name, original_freq=original_freq)
+    if chunksize is not None:
+        return _parse_chunks(file_name, convert, chunksize, engine,
+                             header_lines, squeeze, **read_args)
+    with _open(file_name) as file:
+        header = _read_line(file) if header_lines else ""
+        with instrumentation.timer('parsers.read_csv'):
+            data = pd.read_csv(file, engine=engine, **read_args)
+        if file.seekable():
+            instrumentation.count('bytes_parsed', file.tell())
+    instrumentation.count('samples_parsed', len(data))
+    return convert(data.iloc[:, 0] if squeeze else data, header, 0)
+
+
+def _parse_chunks(file_name: Union[str, IO], convert: Callable[[pd.Series, str, int], FreqSeries],
+                  chunksize: int, engine: str, header_lines: int,
+                  squeeze: bool, **read_args) -> Iterator[FreqSeries]:
+    """Like `_parse`, but yield one `FreqSeries` per chunk."""
+    with _open(file_name) as file:
+        header = _read_line(file) if header_lines else ""
+        offset = 0
+        for data in pd.read_csv(file, engine=engine, chunksize=chunksize,
+                                **read_args):
+            instrumentation.count('samples_parsed', len(data))
+            yield convert(data.iloc[:, 0] if squeeze else data, header, offset)
+            offset += len(data)
+        if file.seekable():
+            instrumentation.count('bytes_parsed', file.tell())
+
+
+def _count_lines(file: BinaryIO) -> int:
+    """Count the lines in a file without parsing them."""
+    file.seek(0)
+    n_lines = 0
+    last_byte = b'\n'
+    for block in iter(lambda: file.read(2**24), b''):
+        n_lines += block.count(b'\n')
+        last_byte = block[-1:]
+    # Account for a missing final line break.
+    return n_lines + (last_byte != b'\n')
+
+
+def _last_line(file: BinaryIO) -> bytes:
+    """Get the last non-empty line of a file, seeking from its end."""
+    end = file.seek(0, os.SEEK_END)
+    tail = b''
+    while end > 0 and tail.rstrip().count(b'\n') < 1:
+        start = max(end - _TAIL_SIZE, 0)
+        file.seek(start)
+        tail = file.read(end - start) + tail
+        end = start
+    return tail.rstrip().rsplit(b'\n', 1)[-1]
+
+
+def _open(file_name: Union[str, IO]) -> ContextManager[IO]:
+    """Open a file for reading, unless it already is one."""
+    if isinstance(file_name, (str, bytes, os.PathLike)):
+        return open(file_name, 'rb')
+    return nullcontext(file_name)
+
+
+def _read_line(file: IO) -> str:
+    """Read a line from a binary or text file."""
+    line = file.readline()
+    return line.decode() if isinstance(line, bytes) else line
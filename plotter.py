@@ -1,42 +1,53 @@
-"""Plotting some meaning out of frequency series."""
+"""Plotting some meaning out of frequency series.
+
+Matplotlib and ballpark are imported on first use only, as they are slow to
+import and not needed for analyses.
+"""
 
 from itertools import cycle
 from math import floor, log10
-from typing import Any, Dict, List, Tuple, Union
+from types import ModuleType
+from typing import TYPE_CHECKING, Any, Dict, List, Tuple, Union
 
-from ballpark import business as ballpark  # human-readable numbers
-import matplotlib
-import matplotlib.pyplot as plt
-from matplotlib.ticker import EngFormatter
+import numpy as np
+import pandas as pd
 
+from . import instrumentation
 from .freq_series import FreqSeries
 from .fbg_util.decorators import static_variable
 from . import statistics as stat
 
 _VERBOSE_METHOD_NAMES = {'adev': "Allan Deviation",
                          'oadev': "Overlapping Allan Deviation",
+                         'mdev': "Modified Allan Deviation",
                          'totdev': "Total Deviation [Howe 2000]"}
 _FIG_WIDTH = 8.  # Figure width in inches.
 _DEFAULT_ASPECT_RATIO = 3/2
 _ERR_ALPHA = .3  # Opacity of the shaded "error" regions.
+_DPI = 600  # Resolution of saved figures.
+
+if TYPE_CHECKING:
+    from matplotlib.figure import Figure
 
 
-def create_figure(aspect: float = _DEFAULT_ASPECT_RATIO) -> matplotlib.figure.Figure:
+def create_figure(aspect: float = _DEFAULT_ASPECT_RATIO) -> 'Figure':
     """Just create an empty figure using default settings.
 
     :param aspect: Figure aspect ratio.
     """
     # Setting the figure width will set the "estimated bounding box" to that
     # size. After rigorous cropping, the resulting PDF will be smaller.
-    return plt.figure(figsize=(_FIG_WIDTH, _FIG_WIDTH / aspect))
+    return _pyplot().figure(figsize=(_FIG_WIDTH, _FIG_WIDTH / aspect))
 
 
+@instrumentation.timed
 def plot_asds(densities: List[stat.Asd],
               aspect: float = _DEFAULT_ASPECT_RATIO,
-              figure: matplotlib.figure.Figure = None,
+              figure: 'Figure' = None,
               merge_labels: bool = False,
-              plot_options: Dict[str, Any] = None) -> matplotlib.figure.Figure:
+              plot_options: Dict[str, Any] = None) -> 'Figure':
     """Plot an ASD."""
+    plt = _pyplot()
     fig = create_figure(aspect=aspect) if figure is None else figure
     asds = densities if isinstance(densities, list) else [densities]
     for asd in asds:
@@ -55,24 +66,27 @@ def plot_asds(densities: List[stat.Asd],
     return fig
 
 
-def save(figure: matplotlib.figure.Figure, file_name: str) -> None:
+@instrumentation.timed
+def save(figure: 'Figure', file_name: str) -> None:
     """Save the figure for publication.
 
     This applies some default export settings.
     """
-    figure.savefig(file_name, bbox_inches='tight', pad_inches=0, dpi=600)
+    figure.savefig(file_name, bbox_inches='tight', pad_inches=0, dpi=_DPI)
     # NOTE that `pad_inches=0` can cause crammed layout in subplot arrangements.
 
 
+@instrumentation.timed
 def plot_deviations(deviations: List[stat.Adev],
-                    figure: matplotlib.figure.Figure = None,
+                    figure: 'Figure' = None,
                     merge_labels: bool = False,
                     aspect: float = _DEFAULT_ASPECT_RATIO,
-                    plot_options: dict = None) -> matplotlib.figure.Figure:
+                    plot_options: dict = None) -> 'Figure':
     """An improved Allan deviation working with circular data sets.
 
     :param show_error: Plot error "bars".
     """
+    plt = _pyplot()
     fig = create_figure(aspect=aspect) if figure is None else figure
     devs = [deviations] if isinstance(deviations, stat.Adev) else deviations
     for dev in devs:
@@ -92,33 +106,70 @@ def plot_deviations(deviations: List[stat.Adev],
     return fig
 
 
+@instrumentation.timed
+def plot_dynamic_deviation(dynamic: stat.DynamicAdev,
+                           figure: 'Figure' = None,
+                           aspect: float = _DEFAULT_ASPECT_RATIO,
+                           cmap: str = 'viridis') -> 'Figure':
+    """Plot a dynamic deviation as heatmap of time and τ.
+
+    The heatmap is drawn as one mesh, which is rasterized when saving to
+    vector formats to keep the files small.
+    """
+    from matplotlib.colors import LogNorm  # pylint: disable=import-outside-toplevel
+    plt = _pyplot()
+    fig = create_figure(aspect=aspect) if figure is None else figure
+    mesh = plt.pcolormesh(dynamic.times, dynamic.taus, dynamic.devs.T,
+                          norm=LogNorm(), cmap=cmap, shading='nearest',
+                          rasterized=True)
+    plt.yscale('log')
+    plt.xlabel("Time in seconds")
+    plt.ylabel("Averaging Time τ in s")
+    fig.colorbar(mesh, label=_VERBOSE_METHOD_NAMES[dynamic.method_name])
+    return fig
+
+
+@instrumentation.timed
 def plot_freq(measurement: Union[FreqSeries, List[FreqSeries]],
-              figure: matplotlib.figure.Figure = None,
+              figure: 'Figure' = None,
               merge_labels: bool = False,
               offset: float = None,
               scatter: bool = False,
-              tight: bool = True) -> Tuple[matplotlib.figure.Figure, float]:
+              tight: bool = True,
+              decimate: bool = True) -> Tuple['Figure', float]:
     """Plot one or more frequency timelines.
 
     :param measurement: One or more (list of) FreqSeries to plot.
     :param figure: Use this figure instead of creating one.
+    :param decimate: Reduce long series to the minimum and maximum value per
+                pixel column of a saved figure (see `_min_max_decimate()`).
+                This speeds up plotting a lot, while looking the same.
     """
+    from matplotlib.ticker import EngFormatter  # pylint: disable=import-outside-toplevel
+    plt = _pyplot()
     fig = create_figure() if figure is None else figure
     mmts: List[FreqSeries] = [measurement] if isinstance(measurement, FreqSeries) else measurement
 
     # Calculate offset to substract for better display.
-    min_value = min([min(mmt.data) for mmt in mmts])
+    min_value = min([np.nanmin(mmt.values) for mmt in mmts])
     if not min_value > 0:
         raise ValueError("Invalid beat note value {}.".format(min_value))
     power = int(floor(log10(min_value)) - 2)
     ax_offset = int(floor(min_value / 10**power) * 10**power) if offset is None else offset
 
+    n_columns = int(fig.get_figwidth() * _DPI)
     for mmt in mmts:
+        if decimate:
+            # Only convert the times of the selected samples.
+            selection = _min_max_decimate(mmt.values, n_columns)
+            times, values = _float_times(mmt, selection), mmt.values[selection]
+        else:
+            times, values = mmt.float_index.values, mmt.values
         if scatter:
-            plt.scatter(mmt.float_index, mmt.data.values - ax_offset,
+            plt.scatter(times, values - ax_offset,
                         label=_label(mmt, merge_labels), alpha=.4)
         else:
-            plt.plot(mmt.float_index, mmt.data.values - ax_offset,
+            plt.plot(times, values - ax_offset,
                      label=_label(mmt, merge_labels), linewidth=1)
 
     plt.xlabel("Time in seconds")
@@ -132,6 +183,18 @@ def plot_freq(measurement: Union[FreqSeries, List[FreqSeries]],
     return (fig, ax_offset)
 
 
+def _float_times(mmt: FreqSeries, positions: np.ndarray) -> np.ndarray:
+    """Like `mmt.float_index.values[positions]`, without converting all times.
+    """
+    implicit = mmt.equidistant_index
+    if implicit is not None:
+        return implicit.start / 1e9 + implicit.period / 1e9 * positions
+    index = mmt.data.index[positions]
+    if isinstance(index, pd.DatetimeIndex):
+        return (pd.to_numeric(index) / 1e9).values
+    return index.values
+
+
 @static_variable('prev_style', None)
 def _generate_line_props(mmt: FreqSeries) -> Dict:
     """Cycle colors and line styles according to measurement sessions.
@@ -143,7 +206,7 @@ def _generate_line_props(mmt: FreqSeries) -> Dict:
             or _generate_line_props.prev_style['session'] != mmt.session):
         # Start new line style cycle and new color.
         _generate_line_props.prev_style = {
-            'color': next(plt.gca()._get_lines.prop_cycler)['color'],
+            'color': next(_pyplot().gca()._get_lines.prop_cycler)['color'],
             'session': mmt.session,
             'style': _get_style_cycler()}
 
@@ -170,10 +233,44 @@ def _label(data: FreqSeries, merge_labels: bool = False) -> str:
 
 def _loglog_grid() -> None:
     """Plot a grid into the current loglog plot."""
-    plt.grid(b=True, which='both')
+    _pyplot().grid(b=True, which='both')
+
+
+def _min_max_decimate(values: np.ndarray, n_buckets: int) -> np.ndarray:
+    """Select the minimum and maximum of each of `n_buckets` equal parts.
+
+    This keeps every spike and the envelope of the data intact, while
+    drastically reducing the number of points to draw. NaNs are ignored,
+    unless a whole part is NaN, in which case one of them is kept to show the
+    gap.
+
+    :returns: Sorted indices of the selected values.
+    """
+    if len(values) <= 2 * n_buckets:
+        return np.arange(len(values))
+    bucket_size = -(-len(values) // n_buckets)  # Round up.
+    n_full = len(values) // bucket_size
+    buckets = values[:n_full * bucket_size].reshape(n_full, bucket_size)
+    offsets = np.arange(n_full) * bucket_size
+    selection = [offsets + extremum for extremum in _nan_arg_extrema(buckets)]
+    if n_full * bucket_size < len(values):
+        rest = values[n_full * bucket_size:]
+        selection.append(n_full * bucket_size + np.array(_nan_arg_extrema(rest)))
+    return np.unique(np.concatenate(selection))
+
+
+def _nan_arg_extrema(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Like `np.nanargmin()` and `np.nanargmax()` along the last axis, but
+    pointing to the first NaN for all-NaN slices instead of raising."""
+    nans = np.isnan(values)
+    if not nans.any():  # Spare the copies.
+        return np.argmin(values, axis=-1), np.argmax(values, axis=-1)
+    return (np.argmin(np.where(nans, np.inf, values), axis=-1),
+            np.argmax(np.where(nans, -np.inf, values), axis=-1))
 
 
 def _pretty(number: float) -> str:
+    from ballpark import business as ballpark  # pylint: disable=import-outside-toplevel
     actual_SI = {  # \u2009 is a thin space.
         24: '\u2009Y', 21: '\u2009Z',
         18: '\u2009E', 15: '\u2009P', 12: '\u2009T',
@@ -183,3 +280,9 @@ def _pretty(number: float) -> str:
         -12: '\u2009p', -15: '\u2009f', -18: '\u2009a',
         -21: '\u2009z', -24: '\u2009y'}
     return ballpark(number, prefixes=actual_SI)
+
+
+def _pyplot() -> ModuleType:
+    """Import pyplot, which is slow and sets up a GUI backend, on first use."""
+    import matplotlib.pyplot as plt  # pylint: disable=import-outside-toplevel
+    return plt
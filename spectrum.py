@@ -0,0 +1,147 @@
+"""Spectral estimates built from individual periodogram segments."""
+from typing import List, Tuple
+import numpy as np
+
+_MAX_BATCH = 2**22
+"""Maximum number of samples to transform in one go."""
+
+
+class WelchAccumulator:
+    """Welch's PSD estimate of a data stream, updated segment by segment.
+
+    Uses the same defaults as `scipy.signal.welch`: Hann window, 50 % overlap,
+    constant detrending and a one-sided density. Once all data has been fed,
+    the result equals that of `scipy.signal.welch`.
+
+    Besides their average, the spread of the segments' periodograms is
+    tracked, yielding an uncertainty estimate without any extra transforms.
+    """
+
+    def __init__(self, rate: float, nperseg: int, nfft: int = None,
+                 n_channels: int = None) -> None:
+        """
+        :param rate: Sample rate of the data in Hz.
+        :param nperseg: Length of each segment.
+        :param nfft: Length of the FFT used, if zero padding is desired.
+        :param n_channels: Accept 2D data of shape (samples, channels), all
+                    channels being transformed at once. The results then are
+                    of shape (channels, frequencies).
+        """
+        self.rate = rate
+        self.nperseg = nperseg
+        self.nfft = nperseg if nfft is None else nfft
+        self.step = nperseg - nperseg // 2
+        self.n_segments = 0
+        channels = () if n_channels is None else (n_channels,)
+        self.power_sum = np.zeros(channels + (self.nfft // 2 + 1,))
+        self.square_sum = np.zeros(channels + (self.nfft // 2 + 1,))
+        """Sum of the squared periodograms, for estimating the uncertainty."""
+        self._window = 0.5 - 0.5 * np.cos(2 * np.pi * np.arange(nperseg) / nperseg)
+        self._scale = 1 / (rate * np.sum(self._window**2))
+        self._pending = np.empty((0,) + channels)
+        """Samples from the start of the next incomplete segment on."""
+
+    @property
+    def freqs(self) -> np.ndarray:
+        return np.fft.rfftfreq(self.nfft, 1 / self.rate)
+
+    @property
+    def powers(self) -> np.ndarray:
+        """Power spectral density, averaged over all complete segments."""
+        return self.power_sum / self.n_segments
+
+    @property
+    def power_errors(self) -> np.ndarray:
+        """Standard error of `powers`, from the spread of the segments.
+
+        Neighbouring segments overlap and thus aren't quite independent. For
+        the Hann window used, this underestimates the error by about 5 %.
+        """
+        mean = self.powers
+        variance = (self.square_sum / self.n_segments - mean**2) * (
+            self.n_segments / (self.n_segments - 1))
+        return np.sqrt(np.maximum(variance, 0) / self.n_segments)
+
+    def add(self, data: np.ndarray) -> None:
+        """Feed the next values of the stream."""
+        samples = np.concatenate((self._pending, data))
+        n_complete = max(len(samples) - self.nperseg, -self.step) // self.step + 1
+        # Don't transform all segments at once, as they overlap.
+        batch = max(_MAX_BATCH // self.nperseg, 1)
+        for first in range(0, n_complete, batch):
+            segments = np.lib.stride_tricks.sliding_window_view(
+                samples, self.nperseg, axis=0)[first * self.step:
+                                       min(first + batch, n_complete) * self.step:
+                                       self.step]
+            powers = periodograms(segments, self._window, self._scale, self.nfft)
+            self.power_sum += powers.sum(0)
+            self.square_sum += np.einsum('i...,i...->...', powers, powers)
+        self.n_segments += n_complete
+        self._pending = samples[n_complete * self.step:]
+
+    def merge(self, other: 'WelchAccumulator') -> None:
+        """Add the segments of an accumulator fed with another part of the data.
+
+        Both must use the same parameters. Samples pending in `other` are
+        ignored, so its part of the data should end at a segment boundary, see
+        `segment_bounds()`.
+        """
+        self.power_sum += other.power_sum
+        self.square_sum += other.square_sum
+        self.n_segments += other.n_segments
+
+
+def log_binned(freqs: np.ndarray, powers: np.ndarray, errors: np.ndarray,
+               bins_per_decade: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Average a spectrum in logarithmically spaced frequency bins.
+
+    This gives a roughly constant number of points per decade, like the LPSD
+    method does. Bins without any frequency of the input are dropped, such that
+    the lowest frequencies are usually passed through as they are.
+
+    :param freqs: Positive, ascending frequencies.
+    :param errors: Standard errors of `powers`, assumed to be independent.
+    :returns: (mean frequencies, mean powers, standard errors) per bin.
+    """
+    bins = np.floor(np.log10(freqs) * bins_per_decade).astype(np.int64)
+    bins -= bins[0]
+    counts = np.bincount(bins)
+    occupied = counts > 0
+    counts = counts[occupied]
+
+    def mean(values: np.ndarray) -> np.ndarray:
+        return np.bincount(bins, weights=values)[occupied] / counts
+
+    return (mean(freqs), mean(powers),
+            np.sqrt(np.bincount(bins, weights=errors**2)[occupied]) / counts)
+
+
+def segment_bounds(length: int, nperseg: int, n_parts: int) -> List[Tuple[int, int]]:
+    """Split data into parts holding whole Welch segments (with 50 % overlap).
+
+    Feeding every part to its own `WelchAccumulator` and merging them yields
+    the same result as feeding all data to one.
+
+    :returns: (start, stop) indices of the (overlapping) parts.
+    """
+    step = nperseg - nperseg // 2
+    n_segments = max((length - nperseg) // step + 1, 0)
+    if not n_segments:
+        return [(0, length)]
+    n_parts = min(n_parts, n_segments)
+    firsts = [n_segments * idx // n_parts for idx in range(n_parts + 1)]
+    return [(first * step, (last - 1) * step + nperseg)
+            for first, last in zip(firsts[:-1], firsts[1:])]
+
+
+def periodograms(segments: np.ndarray, window: np.ndarray, scale: float,
+                 nfft: int) -> np.ndarray:
+    """One-sided, detrended periodogram along the last axis of `segments`."""
+    detrended = segments - segments.mean(axis=-1, keepdims=True)
+    spectra = np.fft.rfft(detrended * window, n=nfft, axis=-1)
+    powers = spectra.real**2 + spectra.imag**2
+    powers *= scale
+    # Fold the negative frequencies, except for DC and Nyquist.
+    powers[..., 1:None if nfft % 2 else -1] *= 2
+    return powers
+
@@ -1,14 +1,46 @@
 """Do the actual statistic analysis."""
-from copy import deepcopy
-from typing import Callable, List, NamedTuple
-import allantools
+from concurrent.futures import Executor
+import importlib
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Sequence, Tuple, Union
 import numpy as np
-from scipy import signal
+import pandas as pd
 
-from .freq_series import FreqSeries
+from . import allan, cache, instrumentation, parallel, spectrum
+from .freq_series import FreqSeries, MultiChannelSeries, split_bounds
 
-_DEFAULT_DEV: Callable = allantools.oadev
+
+class _LazyFunction:  # pylint: disable=too-few-public-methods
+    """Stands in for `module.name`, importing `module` on the first call.
+
+    It carries the name of the function it stands in for, such that e.g.
+    `Adev.method_name` doesn't change. Unlike a wrapper function, it can be
+    pickled and passed to worker processes.
+    """
+
+    def __init__(self, module: str, name: str, alias: str) -> None:
+        """
+        :param alias: Name of the variable in this module holding the stand-in.
+                    Identifies it by module and name, e.g. for memoizing.
+        """
+        self._module = module
+        self.__name__ = name
+        self.__qualname__ = alias
+
+    def __call__(self, *args, **kwargs) -> Any:
+        function = getattr(importlib.import_module(self._module), self.__name__)
+        return function(*args, **kwargs)
+
+
+_DEFAULT_DEV: Callable = _LazyFunction('allantools', 'oadev', '_DEFAULT_DEV')
+"""`allantools.oadev`, as allantools is slow to import."""
 _OK_IRREGULARITY = 1.05
+_N_CHOPS = 10
+"""Number of chops to split a series into for estimating errors."""
+_N_WELCH_PARTS = 16
+"""Number of parts to split the ASD calculation into. It doesn't depend on the
+number of parts run concurrently, such that neither do the results."""
+_MIN_SEGMENT = 100
+"""Shortest segment to consider when splitting a series at gaps."""
 
 
 class Adev(NamedTuple):  # pylint: disable=too-few-public-methods
@@ -56,88 +88,322 @@ class Asd(NamedTuple):  # pylint: disable=too-few-public-methods
     """
 
 
+class DynamicAdev(NamedTuple):  # pylint: disable=too-few-public-methods
+    """A deviation calculated in a sliding window."""
+    method_name: str
+    """Method used for calculating the deviation, see `Adev.method_name`."""
+    measurement: FreqSeries
+    times: np.ndarray
+    """Center of each window, in seconds since the epoch."""
+    taus: np.ndarray
+    devs: np.ndarray
+    """The deviations, of shape (len(times), len(taus))."""
+
+
+@instrumentation.timed
+@cache.memoized
 def asd(measurement: FreqSeries, estimate_error: bool = False,
-        drop_head: int = 6) -> Asd:
-    """Calculate the amplitude spectral density using Welch's method."""
-    def _estimate_error(mmt: FreqSeries, n_chops: int = 10) -> np.ndarray:
-        slice_length = int(len(mmt.data) / n_chops)
-        asds: List[Asd] = []
-        for idx in range(n_chops):
-            chop = deepcopy(mmt)
-            chop.trim(start=idx * slice_length,
-                      end=(n_chops - idx - 1) * slice_length)
-            asds.append(asd(chop, estimate_error=False))
-
-        for density in asds:
-            assert np.array_equal(density.freqs, asds[0].freqs)
-
-        asd_matrix = np.array([asd.ampls for asd in asds])
-        asd_avg = asd_matrix.mean(0)
-        asd_stdev = asd_matrix.std(0) / np.sqrt(n_chops)
-        return np.array([asds[0].freqs, asd_avg - asd_stdev, asd_avg + asd_stdev])
+        drop_head: int = 6, bins_per_decade: int = None,
+        executor: Executor = None, n_jobs: int = None) -> Asd:
+    """Calculate the amplitude spectral density using Welch's method.
 
-    # Try to empirically imagine some good values for values per segment and
-    # FFT length.  The default values produce blocky plots.
-    n_pow = int(np.log2(len(measurement.data)))
-    [freqs, powers] = signal.welch(measurement.data, measurement.sample_rate,
-                                   nperseg=2**(n_pow - 5), nfft=2**(n_pow - 3))
-    # [freqs, powers] = signal.welch(measurement.data, measurement.sample_rate)
+    The periodogram of every segment is calculated just once. Their average is
+    the PSD, while their spread yields the error estimate (see
+    `spectrum.WelchAccumulator.power_errors`).
+
+    Results are cached, see `cache.memoized()`.
 
-    error = _estimate_error(measurement) if estimate_error else None
-    return Asd(measurement, freqs[drop_head:], np.sqrt(powers[drop_head:]), error)
+    :param bins_per_decade: Average the spectrum in that many logarithmically
+                spaced bins per decade, like the LPSD method does. The
+                segments are then transformed without zero padding, which
+                saves computing lots of bins that would only be averaged.
+    :param executor: Process parts of the series concurrently in this
+                executor. See `parallel.map_slices()`.
+    :param n_jobs: Process parts of the series concurrently in a pool of that
+                many processes. See `parallel.map_slices()`.
+    """
+    welch = _welch_parallel(measurement.values, measurement.sample_rate,
+                            bins_per_decade, executor, n_jobs)
+    return _asd_result(measurement, welch.freqs, welch.powers, welch.power_errors,
+                       estimate_error, drop_head, bins_per_decade)
 
 
+@instrumentation.timed
+@cache.memoized
 def deviation(measurement: FreqSeries, estimate_error: bool = True,
               taus: int = None,
               until: float = 0.01,
               allowable_irregularity: float = _OK_IRREGULARITY,
-              method: Callable = _DEFAULT_DEV) -> Adev:
+              method: Callable = _DEFAULT_DEV,
+              executor: Executor = None, n_jobs: int = None,
+              split_gaps: bool = False) -> Adev:
     """Calculate an allan-like deviation for given data.
+
+    Results are cached, see `cache.memoized()`.
     :param taus: τ's to use during calculation of each different measurement.
                 (Plot accuracy)
     :param allowable_irregularity: Deviations in sample rate deemed acceptable.
                 See `FreqSeries`'s documentation on the `sampling_regularity`
                 property.
     :param until: Is passed to `generate_taus`.
+    :param method: Function calculating the deviation, like `allantools.oadev`.
+                For large data sets, consider the faster native
+                implementations in `freqle.allan`.
+    :param executor: Calculate the deviation and its error estimation chops
+                concurrently in this executor. See `parallel.map_slices()`.
+    :param n_jobs: Calculate the deviation and its error estimation chops
+                concurrently in a pool of that many processes. See
+                `parallel.map_slices()`.
+    :param split_gaps: Instead of raising on a series sampled too
+                irregularly, split it into regular segments (see
+                `FreqSeries.segments()`) and combine their deviations.
     :raises ValueError: The data was sampled at a rate too uneven. If this is
-                known and allowable, consider setting `allowable_irregularity`.
-    """
-    def _estimate_error(mmt: FreqSeries, n_chops: int = 10) -> np.ndarray:
-        slice_length = int(len(mmt.data) / n_chops)
-        devs: List[Adev] = []
-        taus: np.ndarray = None
-        for idx in range(n_chops):
-            chop = deepcopy(mmt)
-            chop.trim(start=idx * slice_length,
-                      end=(n_chops - idx - 1) * slice_length)
-            if taus is None:
-                taus = generate_taus(chop, until=.1)
-            # Use the same set of sampling times for all chops.
-            devs.append(deviation(
-                chop, allowable_irregularity=allowable_irregularity,
-                taus=taus, method=method, estimate_error=False))
-
-        dev_matrix = np.array([dev.devs for dev in devs])
-        dev_avg = dev_matrix.mean(0)
-        dev_stdev = dev_matrix.std(0) / np.sqrt(n_chops)
-        actual_tau = devs[0].taus
-        return np.array([actual_tau, dev_avg - dev_stdev, dev_avg + dev_stdev])
-
+                known and allowable, consider setting `allowable_irregularity`
+                or `split_gaps`.
+    """
     mmt = measurement
     if mmt.sampling_regularity > allowable_irregularity:
+        if split_gaps:
+            return _deviation_of_segments(mmt, estimate_error, taus, until,
+                                          allowable_irregularity, method,
+                                          executor, n_jobs)
         raise ValueError(
             "Series is too irregular in sample rate ({}).".format(mmt.sampling_regularity))
 
-    tau, adev, _, _ = method(mmt.data.values, data_type='freq',
-                             rate=mmt.sample_rate,
-                             taus=generate_taus(mmt, until=until) if taus is None else taus)
+    devs = _deviation_tasks(mmt.values, mmt, estimate_error, taus, until, method,
+                            executor, n_jobs)
+    tau, adev, _ = devs[0]
+    error = _error_band(devs[1][0], [dev[1] for dev in devs[1:]]) if estimate_error else None
+    return Adev(_method_name(method), mmt, tau, adev, error)
+
 
-    error = _estimate_error(mmt) if estimate_error else None
+@instrumentation.timed
+@cache.memoized
+def dynamic_deviation(measurement: FreqSeries, window: float, step: float = None,
+                      taus: np.ndarray = None, until: float = 0.1,
+                      allowable_irregularity: float = _OK_IRREGULARITY) -> DynamicAdev:
+    """Calculate the overlapping Allan deviation in a sliding window.
 
+    This shows how the stability changes during a long measurement. All
+    windows are evaluated in a single pass, see `allan.sliding_oadev()`.
+
+    Results are cached, see `cache.memoized()`.
+
+    :param window: Length of the window in seconds.
+    :param step: Time in seconds to advance the window by. Defaults to half
+                the window length.
+    :param taus: τ's to evaluate. Defaults to `generate_taus()` of a window.
+    :param until: Is passed to `generate_taus`.
+    :param allowable_irregularity: See `deviation()`.
+    :raises ValueError: The data was sampled at a rate too uneven.
+    """
+    mmt = measurement
+    if mmt.sampling_regularity > allowable_irregularity:
+        raise ValueError(
+            "Series is too irregular in sample rate ({}).".format(mmt.sampling_regularity))
+    n_window = int(round(window * mmt.sample_rate))
+    n_step = max(int(round((window / 2 if step is None else step) * mmt.sample_rate)), 1)
+    if taus is None:
+        taus = generate_taus(mmt.view(0, n_window), until=until)
+    with instrumentation.timer('statistics.dynamic_deviation.core'):
+        starts, tau, devs = allan.sliding_oadev(mmt.values, mmt.sample_rate, n_window,
+                                                n_step, taus)
+    instrumentation.count('samples_processed', len(mmt))
+    instrumentation.count('taus_evaluated', devs.size)
     if mmt.org_freq:
-        adev /= mmt.org_freq
+        devs /= mmt.org_freq
+    times = mmt.float_index.values[starts + n_window // 2] if len(starts) else np.empty(0)
+    return DynamicAdev('oadev', mmt, times, tau, devs)
+
+
+def channel_asds(measurement: MultiChannelSeries, estimate_error: bool = False,
+                 drop_head: int = 6, bins_per_decade: int = None,
+                 executor: Executor = None, n_jobs: int = None) -> List[Asd]:
+    """Calculate the ASD of every channel, see `asd()`.
+
+    All channels are transformed at once.
+
+    :returns: One result per channel, each holding a view of that channel as
+                `measurement`.
+    """
+    welch = _welch_parallel(measurement.values, measurement.sample_rate,
+                            bins_per_decade, executor, n_jobs)
+    powers, power_errors = welch.powers, welch.power_errors
+    return [_asd_result(channel, welch.freqs, powers[idx], power_errors[idx],
+                        estimate_error, drop_head, bins_per_decade)
+            for idx, channel in enumerate(measurement)]
+
+
+def channel_deviations(measurement: MultiChannelSeries, estimate_error: bool = True,
+                       taus: np.ndarray = None, until: float = 0.01,
+                       allowable_irregularity: float = _OK_IRREGULARITY,
+                       method: Callable = allan.oadev,
+                       executor: Executor = None, n_jobs: int = None) -> List[Adev]:
+    """Calculate the deviation of every channel, see `deviation()`.
+
+    All channels are evaluated at once, so `method` must accept 2D data like
+    the functions in `allan` do.
+
+    :returns: One result per channel, each holding a view of that channel as
+                `measurement`.
+    :raises ValueError: The data was sampled at a rate too uneven.
+    """
+    first = measurement.channel(0)
+    if first.sampling_regularity > allowable_irregularity:
+        raise ValueError(
+            "Series is too irregular in sample rate ({}).".format(first.sampling_regularity))
+    devs = _deviation_tasks(measurement.values, first, estimate_error, taus, until,
+                            method, executor, n_jobs)
+    tau, adev, _ = devs[0]
+    results = []
+    for idx, channel in enumerate(measurement):
+        error = (_error_band(devs[1][0], [dev[1][:, idx] for dev in devs[1:]])
+                 if estimate_error else None)
+        results.append(Adev(_method_name(method), channel, tau, adev[:, idx], error))
+    return results
+
+
+def asds_batch(sources: Sequence[Union[str, FreqSeries]], parser: Callable = None,
+               executor: Executor = None, n_jobs: int = None,
+               max_pending: int = None, **kwargs) -> List[Asd]:
+    """Calculate the ASDs of many measurements at once.
+
+    See `deviations_batch()` for details.
+
+    :param kwargs: Passed to `asd()`.
+    """
+    return _run_batch(asd, sources, parser, executor, n_jobs, max_pending, kwargs)
+
+
+def deviations_batch(sources: Sequence[Union[str, FreqSeries]], parser: Callable = None,
+                     executor: Executor = None, n_jobs: int = None,
+                     max_pending: int = None, **kwargs) -> List[Adev]:
+    """Calculate the deviations of many measurements at once.
+
+    Files are parsed right in the worker processes. Series of equal sample rate
+    and duration are analyzed in one go, sharing their τ's and giving the FFT
+    implementation the chance to reuse its plans.
+
+    :param sources: File names or already parsed series.
+    :param parser: Parser to use for file names, e.g. `parsers.fokus2_txt`.
+    :param executor: Work in this executor, see `parallel.map_bounded()`.
+    :param n_jobs: Work in a pool of that many processes, see
+                `parallel.map_bounded()`.
+    :param max_pending: Maximum number of files or groups of series being
+                worked on (and held in memory) at once.
+    :param kwargs: Passed to `deviation()`.
+    :returns: The deviations, in the order of `sources`.
+    """
+    return _run_batch(deviation, sources, parser, executor, n_jobs, max_pending,
+                      kwargs, share_taus=True)
+
+
+@instrumentation.timed
+def deviation_streaming(chunks: Iterable[FreqSeries], max_tau: float = None,
+                        allowable_irregularity: float = _OK_IRREGULARITY) -> Adev:
+    """Calculate the overlapping Allan deviation of a series too large for RAM.
+
+    The data is consumed chunk by chunk, while only running sums for every τ
+    and a short history of the data are kept in memory. The deviation is
+    evaluated at octave-spaced τ's (2, 4, 8, ... samples).
+
+    :param chunks: Consecutive parts of one measurement, e.g. as obtained by
+                `(FreqSeries(chunk) for chunk in pd.read_table(..., chunksize=N))`.
+    :param max_tau: Largest τ to evaluate, in seconds. Memory usage is
+                proportional to it. Defaults to 2**20 samples.
+    :param allowable_irregularity: See `deviation()`. Applies to each chunk as
+                well as to rate changes and to the sampling interval between
+                chunks, such that dropped or overlapping samples at chunk
+                boundaries are detected, too.
+    :returns: The deviation. As the whole series is never in memory, its
+                `measurement` only holds the first and last sample of the
+                stream.
+    :raises ValueError: The data was sampled at a rate too uneven.
+    """
+    first: FreqSeries = None
+    last: FreqSeries = None
+    accumulator: allan.OadevAccumulator = None
+    regularity = 1.
+    for chunk in chunks:
+        if first is None:
+            first = chunk
+            max_m = 2**20 if max_tau is None else int(max_tau * chunk.sample_rate)
+            accumulator = allan.OadevAccumulator(
+                chunk.sample_rate, 2**np.arange(1, max(int(np.log2(max_m)), 1) + 1))
+        regularity = max(regularity, chunk.sampling_regularity,
+                         chunk.sample_rate / first.sample_rate,
+                         first.sample_rate / chunk.sample_rate)
+        if last is not None:
+            ratio = _boundary_interval(last, chunk) * first.sample_rate
+            regularity = max(regularity, ratio, 1 / ratio if ratio > 0 else np.inf)
+        if regularity > allowable_irregularity:
+            raise ValueError(
+                "Series is too irregular in sample rate ({}).".format(regularity))
+        accumulator.add(chunk.values)
+        instrumentation.count('samples_processed', len(chunk))
+        last = chunk
+    if first is None:
+        raise ValueError("Got no data.")
+
+    summary = FreqSeries(
+        pd.concat([first.view(0, 1).data, last.view(-1).data]),
+        original_freq=first.org_freq, session=first.session,
+        rate_analysis=(first.sample_rate, regularity))
+    tau, adev, _, _ = accumulator.result()
+    if summary.org_freq:
+        adev /= summary.org_freq
+    return Adev('oadev', summary, tau, adev)
+
+
+class IncrementalStatistics:
+    """Allan deviation and ASD of a growing `FreqSeries`.
+
+    Call `update()` after appending to the series. Only the new samples are
+    processed then, so the cost of an update doesn't depend on the length of
+    the series.
+
+    As the series' final length is unknown, the deviation is evaluated at
+    octave-spaced τ's (like `deviation_streaming()`) and the ASD uses a fixed
+    segment length.
+    """
 
-    return Adev(method.__name__, mmt, tau, adev, error)
+    def __init__(self, measurement: FreqSeries, max_tau: float = None,
+                 nperseg: int = 2**12, nfft: int = None) -> None:
+        """
+        :param measurement: The series to analyze, as it grows.
+        :param max_tau: See `deviation_streaming()`.
+        :param nperseg: Segment length used for the ASD.
+        :param nfft: FFT length used for the ASD, see `scipy.signal.welch`.
+        """
+        self.measurement = measurement
+        rate = measurement.sample_rate
+        max_m = 2**20 if max_tau is None else int(max_tau * rate)
+        self._adev = allan.OadevAccumulator(
+            rate, 2**np.arange(1, max(int(np.log2(max_m)), 1) + 1))
+        self._welch = spectrum.WelchAccumulator(rate, nperseg, nfft)
+        self._n_processed = 0
+        self.update()
+
+    @instrumentation.timed
+    def update(self) -> None:
+        """Process the samples appended since the last update."""
+        new = self.measurement.values[self._n_processed:]
+        instrumentation.count('samples_processed', len(new))
+        self._adev.add(new)
+        self._welch.add(new)
+        self._n_processed += len(new)
+
+    def asd(self, drop_head: int = 6) -> Asd:
+        """The ASD of all processed samples, see `asd()`."""
+        return Asd(self.measurement, self._welch.freqs[drop_head:],
+                   np.sqrt(self._welch.powers[drop_head:]))
+
+    def deviation(self) -> Adev:
+        """The overlapping Allan deviation of all processed samples."""
+        tau, adev, _, _ = self._adev.result()
+        if self.measurement.org_freq:
+            adev /= self.measurement.org_freq
+        return Adev('oadev', self.measurement, tau, adev)
 
 
 def generate_taus(mmt: FreqSeries, n_taus: int = 300, until: float = .1) -> np.ndarray:
@@ -150,3 +416,230 @@ def generate_taus(mmt: FreqSeries, n_taus: int = 300, until: float = .1) -> np.n
     """
     # Conservative estimate for meaningful τ values based on data.
     return np.geomspace(2/mmt.sample_rate, mmt.duration * until, num=n_taus)
+
+
+def _analyze_batch(analysis: Callable, sources: List[Union[str, FreqSeries]],
+                   parser: Callable, kwargs: dict, detach: bool) -> list:
+    """Parse (if necessary) and analyze some sources of a batch.
+
+    :param detach: Don't return the measurements parsed from files, if they
+                can be loaded from the cache instead of being transferred.
+    :returns: (result, cache file) per source. For detached measurements, the
+                result holds none, but the cache file to load it from.
+    """
+    results = []
+    for source in sources:
+        mmt = parser(source) if isinstance(source, str) else source
+        result = analysis(mmt, **kwargs)
+        cache_file = cache.file_of(mmt) if detach and isinstance(source, str) else None
+        if cache_file is not None:
+            result = result._replace(measurement=None)
+        results.append((result, cache_file))
+    return results
+
+
+def _asd_result(mmt: FreqSeries, freqs: np.ndarray, powers: np.ndarray,
+                power_errors: np.ndarray, estimate_error: bool, drop_head: int,
+                bins_per_decade: int) -> Asd:
+    """Assemble the `asd()` of a series from its PSD."""
+    freqs = freqs[drop_head:]
+    powers = powers[drop_head:]
+    power_errors = power_errors[drop_head:]
+    if bins_per_decade:
+        positive = freqs > 0
+        freqs, powers, power_errors = spectrum.log_binned(
+            freqs[positive], powers[positive], power_errors[positive], bins_per_decade)
+    error = None
+    if estimate_error:
+        error = np.array([freqs, np.sqrt(np.maximum(powers - power_errors, 0)),
+                          np.sqrt(powers + power_errors)])
+    return Asd(mmt, freqs, np.sqrt(powers), error)
+
+
+def _boundary_interval(previous: FreqSeries, following: FreqSeries) -> float:
+    """Time in seconds from the last sample of `previous` to the first of
+    `following`."""
+    delta = following.view(0, 1).data.index[0] - previous.view(-1).data.index[0]
+    return delta.total_seconds() if isinstance(delta, pd.Timedelta) else float(delta)
+
+
+def _combine_segments(taus: np.ndarray,
+                      results: List[Tuple[np.ndarray, np.ndarray, np.ndarray]]
+                      ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Combine the deviations of several segments into one.
+
+    The variances are averaged, weighted by their number of terms. Segments of
+    different sample rates evaluate slightly different τ's, so every result is
+    attributed to the nearest of the requested `taus`.
+
+    :param results: Like returned by `_deviate()`.
+    :returns: (τ's, deviations, number of terms)
+    """
+    variances = np.zeros(len(taus))
+    tau_sums = np.zeros(len(taus))
+    terms = np.zeros(len(taus))
+    for tau, dev, n_terms in results:
+        nearest = np.abs(np.log(taus)[:, np.newaxis] - np.log(tau)).argmin(0)
+        np.add.at(variances, nearest, n_terms * dev**2)
+        np.add.at(tau_sums, nearest, n_terms * tau)
+        np.add.at(terms, nearest, n_terms)
+    valid = terms > 0
+    return (tau_sums[valid] / terms[valid], np.sqrt(variances[valid] / terms[valid]),
+            terms[valid])
+
+
+def _deviate(freqs: np.ndarray, rate: float, taus: np.ndarray,
+             method: Callable, org_freq: float = None,
+             stage: str = 'statistics.deviation.core') -> Tuple[np.ndarray, np.ndarray]:
+    """Calculate the deviation of raw frequency values.
+
+    :param stage: Record the calculation as this stage, see `instrumentation`.
+    :returns: (τ's actually used, deviations, number of terms averaged)
+    """
+    with instrumentation.timer(stage):
+        tau, adev, _, n_terms = method(freqs, data_type='freq', rate=rate, taus=taus)
+    instrumentation.count('samples_processed', freqs.size)
+    instrumentation.count('taus_evaluated', len(tau))
+    if org_freq:
+        adev /= org_freq
+    return tau, adev, n_terms
+
+
+def _deviation_tasks(values: np.ndarray, mmt: FreqSeries, estimate_error: bool,
+                     taus: np.ndarray, until: float, method: Callable,
+                     executor: Executor, n_jobs: int) -> List[Tuple[np.ndarray, ...]]:
+    """Calculate the deviation of `values` and, if requested, of its chops.
+
+    :param values: Frequencies of one or (as 2D array) several channels.
+    :param mmt: The series (or a channel of it) `values` belong to.
+    :returns: Results of `_deviate()` for the whole data, followed by those for
+                the chops.
+    """
+    tasks = [(0, len(values), (
+        mmt.sample_rate, generate_taus(mmt, until=until) if taus is None else taus,
+        method, mmt.org_freq, 'statistics.deviation.core'))]
+    if estimate_error:
+        chops = split_bounds(len(values), _N_CHOPS)
+        # Use the same set of sampling times for all chops.
+        chop_taus = generate_taus(mmt.view(*chops[0]), until=.1)
+        tasks += [(start, stop, (mmt.sample_rate, chop_taus, method, mmt.org_freq,
+                                 'statistics.deviation.chops'))
+                  for start, stop in chops]
+    return parallel.map_slices(_deviate, values, tasks, executor=executor, n_jobs=n_jobs)
+
+
+def _deviation_of_segments(mmt: FreqSeries, estimate_error: bool, taus: np.ndarray,
+                           until: float, allowable_irregularity: float,
+                           method: Callable, executor: Executor,
+                           n_jobs: int) -> Adev:
+    """`deviation()` of a series split at gaps and rate changes.
+
+    Errors are estimated from the total number of terms averaged per τ (like
+    `allantools` does), as segments are usually too short for chopping.
+    """
+    segments = [segment for segment in mmt.segments(allowable_irregularity, _MIN_SEGMENT)
+                if segment.sampling_regularity <= allowable_irregularity]
+    if not segments:
+        raise ValueError("Series has no regularly sampled segment.")
+    if taus is None:  # Like `generate_taus()`, covering all segments.
+        taus = np.geomspace(2 / max(segment.sample_rate for segment in segments),
+                            max(segment.duration for segment in segments) * until,
+                            num=300)
+    results = parallel.map_bounded(
+        _deviate, [(segment.values, segment.sample_rate, taus, method, mmt.org_freq)
+                   for segment in segments],
+        executor=executor, n_jobs=n_jobs)
+    tau, adev, n_terms = _combine_segments(np.asarray(taus, dtype=float), results)
+    error = None
+    if estimate_error:
+        error = np.array([tau, adev - adev / np.sqrt(n_terms),
+                          adev + adev / np.sqrt(n_terms)])
+    return Adev(_method_name(method), mmt, tau, adev, error)
+
+
+def _error_band(abscissa: np.ndarray, chop_values: List[np.ndarray]) -> np.ndarray:
+    """Estimate an uncertainty band from results obtained on several chops.
+
+    :returns: Array like `Adev.errors` or `Asd.errors`.
+    """
+    matrix = np.array(chop_values)
+    avg = matrix.mean(0)
+    stdev = matrix.std(0) / np.sqrt(len(chop_values))
+    return np.array([abscissa, avg - stdev, avg + stdev])
+
+
+def _method_name(method: Callable) -> str:
+    """Name of a deviation method, looking through `functools.partial`."""
+    return getattr(getattr(method, 'func', method), '__name__', repr(method))
+
+
+def _run_batch(analysis: Callable, sources: Sequence[Union[str, FreqSeries]],
+               parser: Callable, executor: Executor, n_jobs: int,
+               max_pending: int, kwargs: dict, share_taus: bool = False) -> list:
+    """Common implementation of `deviations_batch()` and `asds_batch()`."""
+    if parser is None and any(isinstance(source, str) for source in sources):
+        raise ValueError("A parser is needed for analyzing files.")
+    detach = executor is not None or n_jobs is not None
+    detach = detach and cache.is_enabled()
+
+    # Files are worked on one by one, series in groups of the same shape.
+    groups: Dict[Any, List[int]] = {}
+    for idx, source in enumerate(sources):
+        key = ((source.sample_rate, len(source), source.duration)
+               if isinstance(source, FreqSeries) else idx)
+        groups.setdefault(key, []).append(idx)
+
+    tasks = []
+    for members in groups.values():
+        group_kwargs = kwargs
+        first = sources[members[0]]
+        if share_taus and isinstance(first, FreqSeries) and kwargs.get('taus') is None:
+            group_kwargs = dict(kwargs, taus=generate_taus(
+                first, until=kwargs.get('until', 0.01)))
+        tasks.append((analysis, [sources[idx] for idx in members], parser,
+                      group_kwargs, detach))
+    group_results = parallel.map_bounded(_analyze_batch, tasks, executor=executor,
+                                         n_jobs=n_jobs, max_pending=max_pending)
+
+    results = [None] * len(sources)
+    for members, group in zip(groups.values(), group_results):
+        for idx, (result, cache_file) in zip(members, group):
+            if cache_file is not None:  # Was detached, see `_analyze_batch`.
+                try:
+                    mmt = cache.load(cache_file)
+                except (OSError, ValueError):  # Evicted from the cache since.
+                    mmt = parser(sources[idx])
+                result = result._replace(measurement=mmt)
+            results[idx] = result
+    return results
+
+
+def _welch(freqs: np.ndarray, rate: float, nperseg: int,
+           nfft: int) -> spectrum.WelchAccumulator:
+    """Welch's PSD estimate of raw frequency values, see `scipy.signal.welch`.
+
+    :param freqs: Values of one or (as 2D array) several channels.
+    """
+    instrumentation.count('samples_processed', freqs.size)
+    with instrumentation.timer('statistics.asd.core'):
+        welch = spectrum.WelchAccumulator(
+            rate, nperseg, nfft, freqs.shape[1] if freqs.ndim > 1 else None)
+        welch.add(freqs)
+    return welch
+
+
+def _welch_parallel(values: np.ndarray, rate: float, bins_per_decade: int,
+                    executor: Executor, n_jobs: int) -> spectrum.WelchAccumulator:
+    """`_welch()` on parts of `values`, as parametrized by `asd()`."""
+    # Try to empirically imagine some good values for values per segment and
+    # FFT length.  The default values produce blocky plots.
+    n_pow = int(np.log2(len(values)))
+    nperseg = 2**(n_pow - 5)
+    nfft = nperseg if bins_per_decade else 2**(n_pow - 3)
+    tasks = [(start, stop, (rate, nperseg, nfft)) for start, stop
+             in spectrum.segment_bounds(len(values), nperseg, _N_WELCH_PARTS)]
+    parts = parallel.map_slices(_welch, values, tasks, executor=executor, n_jobs=n_jobs)
+    welch = parts[0]
+    for part in parts[1:]:
+        welch.merge(part)
+    return welch